@@ -1,13 +1,31 @@
 import os
+import re
 import json
-import requests
+import time
+import atexit
+import contextlib
+import zlib
+import sqlite3
+import hashlib
+import threading
+import asyncio
+import aiohttp
+import httpx
+import numpy as np
 import chainlit as cl
+from collections import OrderedDict
 from rich.console import Console
 from rich.panel import Panel
-from azure.search.documents import SearchClient
+from azure.search.documents.aio import SearchClient
 from azure.core.credentials import AzureKeyCredential
+from azure.core.pipeline.transport import AioHttpTransport
 from azure.search.documents.models import VectorizableTextQuery
-from openai import AzureOpenAI
+from openai import AsyncAzureOpenAI
+
+try:
+    import tiktoken
+except ImportError:  # optional: token counts fall back to an estimate
+    tiktoken = None
 
 # ----------------------------
 # Configuration (set via environment variables)
@@ -16,36 +34,343 @@ AZURE_OPENAI_API_KEY = os.getenv("AZURE_OPENAI_API_KEY", "your-azure-openai-api-
 AZURE_OPENAI_API_VERSION = os.getenv("AZURE_OPENAI_API_VERSION", "2024-10-21")
 AZURE_OPENAI_ENDPOINT = os.getenv("AZURE_OPENAI_ENDPOINT", "https://your-azure-openai-endpoint.openai.azure.com/")
 AZURE_OPENAI_CHAT_COMPLETION_DEPLOYED_MODEL_NAME = os.getenv("AZURE_OPENAI_CHAT_COMPLETION_DEPLOYED_MODEL_NAME", "gpt-4o")
+# Optional: only needed for near-duplicate matching in the search result cache
+AZURE_OPENAI_EMBEDDING_DEPLOYMENT = os.getenv("AZURE_OPENAI_EMBEDDING_DEPLOYMENT")
 
 AZURE_SEARCH_ENDPOINT = os.getenv("AZURE_SEARCH_SERVICE_ENDPOINT", "https://your-search-service.search.windows.net")
 AZURE_SEARCH_KEY = os.getenv("AZURE_SEARCH_ADMIN_KEY", "your-azure-search-key")
 SEARCH_INDEX_NAME = "fifa-legal-handbook"
+# Connection pool size per (endpoint, index) and how often idle clients are re-validated
+AZURE_SEARCH_POOL_MAXSIZE = int(os.getenv("AZURE_SEARCH_POOL_MAXSIZE", "20"))
+AZURE_SEARCH_HEALTH_CHECK_SECONDS = float(os.getenv("AZURE_SEARCH_HEALTH_CHECK_SECONDS", "300"))
+# Token budget for the retrieved chunks handed back to the model per search
+SEARCH_CONTEXT_TOKEN_BUDGET = int(os.getenv("SEARCH_CONTEXT_TOKEN_BUDGET", "4000"))
+# Search result cache: size, TTL, optional SQLite file and optional cosine similarity threshold (e.g. 0.95)
+SEARCH_CACHE_MAX_ENTRIES = int(os.getenv("SEARCH_CACHE_MAX_ENTRIES", "256"))
+SEARCH_CACHE_TTL_SECONDS = float(os.getenv("SEARCH_CACHE_TTL_SECONDS", "3600"))
+SEARCH_CACHE_PATH = os.getenv("SEARCH_CACHE_PATH")
+SEARCH_CACHE_SIMILARITY_THRESHOLD = float(os.environ["SEARCH_CACHE_SIMILARITY_THRESHOLD"]) if os.getenv("SEARCH_CACHE_SIMILARITY_THRESHOLD") else None
 
 BING_SEARCH_API_KEY = os.getenv("BING_SEARCH_API_KEY", "your-bing-search-api-key")
 BING_SEARCH_ENDPOINT = "https://api.bing.microsoft.com/v7.0/search"
+# Local router: routes once each tool has this many LLM-routed examples and the match is confident.
+# It only learns tool routes, so queries the LLM answers directly always take the routing call.
+ROUTER_MODEL_PATH = os.getenv("ROUTER_MODEL_PATH")
+# The model file is rewritten at most this often (and at shutdown), off the event loop
+ROUTER_SAVE_SECONDS = float(os.getenv("ROUTER_SAVE_SECONDS", "30"))
+ROUTER_MIN_EXAMPLES = int(os.getenv("ROUTER_MIN_EXAMPLES", "20"))
+ROUTER_MIN_SIMILARITY = float(os.getenv("ROUTER_MIN_SIMILARITY", "0.35"))
+ROUTER_MIN_MARGIN = float(os.getenv("ROUTER_MIN_MARGIN", "0.15"))
+# Speculative retrieval during the routing call: "off", "likely" (the router's best guess) or "all" (every allowed tool).
+# "likely" starts nothing until the local router has ROUTER_MIN_EXAMPLES LLM-routed queries for every tool.
+SPECULATIVE_RETRIEVAL = os.getenv("SPECULATIVE_RETRIEVAL", "off").lower()
+SPECULATIVE_TOOLS = [name.strip() for name in os.getenv("SPECULATIVE_TOOLS", "search_azure_ai_search,search_bing").split(",") if name.strip()]
+SPECULATION_MIN_SIMILARITY = float(os.getenv("SPECULATION_MIN_SIMILARITY", "0.2"))
+SPECULATION_MAX_IN_FLIGHT = int(os.getenv("SPECULATION_MAX_IN_FLIGHT", "8"))
+SPECULATION_MIN_QUERY_OVERLAP = float(os.getenv("SPECULATION_MIN_QUERY_OVERLAP", "0.5"))
 
 # ----------------------------
-# Initialize Azure OpenAI client and console
+# Initialize async Azure OpenAI / HTTP clients and console
 # ----------------------------
-openai_client = AzureOpenAI(
+# All I/O goes through asyncio-native clients so one Chainlit worker can serve many
+# concurrent chat sessions without blocking the event loop.
+openai_client = AsyncAzureOpenAI(
     api_key=AZURE_OPENAI_API_KEY,
     api_version=AZURE_OPENAI_API_VERSION,
     azure_endpoint=AZURE_OPENAI_ENDPOINT,
 )
+http_client = httpx.AsyncClient(
+    timeout=httpx.Timeout(30.0),
+    limits=httpx.Limits(max_connections=100, max_keepalive_connections=20),
+)
 console = Console()
 
+# ----------------------------
+# Shared Azure AI Search clients (one pooled, keep-alive client per endpoint/index)
+# ----------------------------
+_search_clients = {}
+_search_clients_lock = asyncio.Lock()
+
+def _create_search_client(endpoint: str, index_name: str) -> SearchClient:
+    # Must be called from the running event loop: the aiohttp session binds to it.
+    session = aiohttp.ClientSession(
+        connector=aiohttp.TCPConnector(limit=AZURE_SEARCH_POOL_MAXSIZE)
+    )
+    return SearchClient(
+        endpoint=endpoint,
+        index_name=index_name,
+        credential=AzureKeyCredential(AZURE_SEARCH_KEY),
+        transport=AioHttpTransport(session=session, session_owner=True),
+    )
+
+async def get_search_client(endpoint: str = AZURE_SEARCH_ENDPOINT, index_name: str = SEARCH_INDEX_NAME) -> SearchClient:
+    """Return the process-wide SearchClient for (endpoint, index_name), probing it when idle past the health-check interval and rebuilding it if the probe fails."""
+    key = (endpoint, index_name)
+    async with _search_clients_lock:
+        entry = _search_clients.get(key)
+        now = time.monotonic()
+        if entry is None:
+            entry = {"client": _create_search_client(endpoint, index_name), "used_at": now}
+            _search_clients[key] = entry
+            return entry["client"]
+        idle = now - entry["used_at"] > AZURE_SEARCH_HEALTH_CHECK_SECONDS
+        entry["used_at"] = now
+    if not idle:
+        return entry["client"]
+    # Probe outside the lock so other sessions are not held up by a slow service
+    try:
+        await entry["client"].get_document_count()
+        return entry["client"]
+    except Exception as e:
+        console.print(Panel(f"Search client health check failed, reconnecting: {e}", style="bold red"))
+    async with _search_clients_lock:
+        current = _search_clients.get(key)
+        stale = current is entry
+        if stale or current is None:
+            _search_clients[key] = {"client": _create_search_client(endpoint, index_name), "used_at": time.monotonic()}
+        client = _search_clients[key]["client"]
+    if stale:
+        await entry["client"].close()
+    return client
+
+async def close_clients():
+    async with _search_clients_lock:
+        for entry in _search_clients.values():
+            await entry["client"].close()
+        _search_clients.clear()
+    await http_client.aclose()
+    await openai_client.close()
+    # chainlit ends the process with os._exit(), so atexit handlers do not run under it
+    await asyncio.to_thread(route_classifier.save)
+
+# ----------------------------
+# Search result cache
+# ----------------------------
+class SearchResultCache:
+    """LRU + TTL cache of search tool output keyed on normalized query text and search parameters.
+
+    Entries can also be persisted to a SQLite file, bounded to the same max_entries, and,
+    when embeddings are supplied, matched by query similarity.
+    """
+
+    def __init__(self, max_entries: int, ttl_seconds: float, path=None, similarity_threshold=None):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.similarity_threshold = similarity_threshold
+        self.hits = 0
+        self.similar_hits = 0
+        self.misses = 0
+        # key -> (expires_at, params_key, value, embedding)
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._db = None
+        if path:
+            self._db = sqlite3.connect(path, check_same_thread=False)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS search_cache "
+                "(key TEXT PRIMARY KEY, expires_at REAL, value TEXT, used_at REAL DEFAULT 0)"
+            )
+            columns = [row[1] for row in self._db.execute("PRAGMA table_info(search_cache)")]
+            if "used_at" not in columns:  # a file written before the table was size-bounded
+                self._db.execute("ALTER TABLE search_cache ADD COLUMN used_at REAL DEFAULT 0")
+            self._db.commit()
+
+    @staticmethod
+    def _keys(query: str, params: dict):
+        normalized = " ".join(query.lower().split()).rstrip("?.! ")
+        params_key = json.dumps(params, sort_keys=True)
+        key = hashlib.sha256(f"{params_key}\n{normalized}".encode()).hexdigest()
+        return key, params_key
+
+    @staticmethod
+    def _normalize_vector(embedding):
+        vector = np.asarray(embedding, dtype=np.float32)
+        return vector / (np.linalg.norm(vector) or 1.0)
+
+    def get(self, query: str, params: dict):
+        """Return the cached output for an exact (normalized) match, or None."""
+        key, params_key = self._keys(query, params)
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] > now:
+                self._entries.move_to_end(key)
+                self._touch(key, now)
+                self.hits += 1
+                return entry[2]
+            if entry is not None:
+                del self._entries[key]
+            if self._db is not None:
+                row = self._db.execute(
+                    "SELECT expires_at, value FROM search_cache WHERE key = ?", (key,)
+                ).fetchone()
+                if row is not None and row[0] > now:
+                    self._store(key, row[0], params_key, row[1], None)
+                    self._touch(key, now)
+                    self.hits += 1
+                    return row[1]
+            return None
+
+    def get_similar(self, embedding, params: dict):
+        """Return the output cached for the most similar earlier query with the same parameters, or None.
+
+        This is the last lookup stage after get(), so a None result counts as a miss.
+        """
+        if self.similarity_threshold is None or embedding is None:
+            with self._lock:
+                self.misses += 1
+            return None
+        params_key = json.dumps(params, sort_keys=True)
+        query_vector = self._normalize_vector(embedding)
+        now = time.time()
+        with self._lock:
+            best_key, best_score = None, self.similarity_threshold
+            for key, (expires_at, entry_params, _, vector) in self._entries.items():
+                if vector is None or entry_params != params_key or expires_at <= now:
+                    continue
+                score = float(np.dot(query_vector, vector))
+                if score >= best_score:
+                    best_key, best_score = key, score
+            if best_key is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(best_key)
+            self._touch(best_key, now)
+            self.similar_hits += 1
+            return self._entries[best_key][2]
+
+    def put(self, query: str, params: dict, value: str, embedding=None):
+        """Store fresh search output."""
+        key, params_key = self._keys(query, params)
+        now = time.time()
+        expires_at = now + self.ttl_seconds
+        vector = None if embedding is None else self._normalize_vector(embedding)
+        with self._lock:
+            self._store(key, expires_at, params_key, value, vector)
+            if self._db is not None:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO search_cache (key, expires_at, value, used_at) "
+                    "VALUES (?, ?, ?, ?)",
+                    (key, expires_at, value, now),
+                )
+                self._db.execute("DELETE FROM search_cache WHERE expires_at <= ?", (now,))
+                # Same LRU bound as in memory: keep the max_entries most recently used
+                self._db.execute(
+                    "DELETE FROM search_cache WHERE key NOT IN "
+                    "(SELECT key FROM search_cache ORDER BY used_at DESC LIMIT ?)",
+                    (self.max_entries,),
+                )
+                self._db.commit()
+
+    def _touch(self, key, now):
+        # Keeps the SQLite copy's LRU order in step with the in-memory one
+        if self._db is not None:
+            self._db.execute("UPDATE search_cache SET used_at = ? WHERE key = ?", (now, key))
+            self._db.commit()
+
+    def _store(self, key, expires_at, params_key, value, vector):
+        self._entries[key] = (expires_at, params_key, value, vector)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "similar_hits": self.similar_hits,
+                "misses": self.misses,
+                "entries": len(self._entries),
+            }
+
+search_cache = SearchResultCache(
+    max_entries=SEARCH_CACHE_MAX_ENTRIES,
+    ttl_seconds=SEARCH_CACHE_TTL_SECONDS,
+    path=SEARCH_CACHE_PATH,
+    similarity_threshold=SEARCH_CACHE_SIMILARITY_THRESHOLD,
+)
+
+async def embed_query(query: str):
+    """Embed a query for near-duplicate cache matching (None when not configured)."""
+    if not (AZURE_OPENAI_EMBEDDING_DEPLOYMENT and SEARCH_CACHE_SIMILARITY_THRESHOLD):
+        return None
+    try:
+        response = await openai_client.embeddings.create(
+            model=AZURE_OPENAI_EMBEDDING_DEPLOYMENT, input=query
+        )
+    except Exception:
+        return None
+    return response.data[0].embedding
+
+# ----------------------------
+# Token-budgeted context assembly
+# ----------------------------
+_token_encoding = None
+
+def count_tokens(text: str) -> int:
+    """Count tokens with tiktoken's o200k_base encoding (GPT-4o), or estimate ~4 characters per token without tiktoken."""
+    global _token_encoding
+    if tiktoken is None:
+        return (len(text) + 3) // 4
+    if _token_encoding is None:
+        _token_encoding = tiktoken.get_encoding("o200k_base")
+    return len(_token_encoding.encode(text))
+
+def _shingles(text: str, size: int = 5) -> set:
+    words = text.lower().split()
+    return {" ".join(words[i : i + size]) for i in range(max(1, len(words) - size + 1))}
+
+# Totals across calls; "last_*" describe the most recent call.
+context_metrics = {
+    "calls": 0,
+    "tokens_retrieved": 0,
+    "tokens_used": 0,
+    "tokens_saved": 0,
+    "last_tokens_saved": 0,
+}
+
+def build_context(chunks, token_budget: int = SEARCH_CONTEXT_TOKEN_BUDGET, overlap: float = 0.8) -> str:
+    """Build tool output from (text, score) pairs: best reranker score first, skipping near-duplicate chunks, within the token budget."""
+    selected = []
+    seen_shingles = set()
+    tokens_retrieved = 0
+    tokens_used = 0
+    for text, _ in sorted(chunks, key=lambda chunk: chunk[1], reverse=True):
+        if not text:
+            continue
+        tokens = count_tokens(text)
+        tokens_retrieved += tokens
+        shingles = _shingles(text)
+        if len(shingles & seen_shingles) >= overlap * len(shingles):
+            continue
+        if tokens_used + tokens > token_budget:
+            continue
+        selected.append(text)
+        seen_shingles |= shingles
+        tokens_used += tokens
+
+    context_metrics["calls"] += 1
+    context_metrics["tokens_retrieved"] += tokens_retrieved
+    context_metrics["tokens_used"] += tokens_used
+    context_metrics["tokens_saved"] += tokens_retrieved - tokens_used
+    context_metrics["last_tokens_saved"] = tokens_retrieved - tokens_used
+    return "\n".join(selected)
+
 # ----------------------------
 # Define search functions (tools)
 # ----------------------------
-def search_azure_ai_search(query: str) -> str:
+async def search_azure_ai_search(query: str) -> str:
     """Search the private FIFA Legal Handbook using Azure AI Search."""
-    credential = AzureKeyCredential(AZURE_SEARCH_KEY)
-    client = SearchClient(
-        endpoint=AZURE_SEARCH_ENDPOINT,
-        index_name=SEARCH_INDEX_NAME,
-        credential=credential,
-    )
-    results = client.search(
+    search_params = {"index": SEARCH_INDEX_NAME, "k_nearest_neighbors": 50, "query_type": "semantic", "top": 50, "token_budget": SEARCH_CONTEXT_TOKEN_BUDGET}
+    cached = search_cache.get(query, search_params)
+    if cached is None:
+        query_embedding = await embed_query(query)
+        cached = search_cache.get_similar(query_embedding, search_params)
+    if cached is not None:
+        console.print(Panel(f"Tool Invoked: Azure AI Search (cached)\nQuery: {query}", style="bold yellow"))
+        return cached
+    client = await get_search_client(AZURE_SEARCH_ENDPOINT, SEARCH_INDEX_NAME)
+    results = await client.search(
         search_text=query,
         vector_queries=[
             VectorizableTextQuery(
@@ -58,16 +383,23 @@ def search_azure_ai_search(query: str) -> str:
         top=50,
         include_total_count=True,
     )
-    retrieved_texts = [result.get("chunk", "") for result in results]
-    context_str = "\n".join(retrieved_texts) if retrieved_texts else "No documents found."
-    console.print(Panel(f"Tool Invoked: Azure AI Search\nQuery: {query}", style="bold yellow"))
+    chunks = [
+        (result.get("chunk", ""), result.get("@search.reranker_score") or result.get("@search.score") or 0.0)
+        async for result in results
+    ]
+    context_str = build_context(chunks) or "No documents found."
+    search_cache.put(query, search_params, context_str, query_embedding)
+    console.print(Panel(
+        f"Tool Invoked: Azure AI Search\nQuery: {query}\nTokens saved: {context_metrics['last_tokens_saved']}",
+        style="bold yellow",
+    ))
     return context_str
 
-def search_bing(query: str) -> str:
+async def search_bing(query: str) -> str:
     """Search the public web using Bing Search API."""
     headers = {"Ocp-Apim-Subscription-Key": BING_SEARCH_API_KEY}
     params = {"q": query, "textDecorations": True, "textFormat": "Raw"}
-    response = requests.get(BING_SEARCH_ENDPOINT, headers=headers, params=params)
+    response = await http_client.get(BING_SEARCH_ENDPOINT, headers=headers, params=params)
     if response.status_code == 200:
         data = response.json()
         if "webPages" in data and "value" in data["webPages"]:
@@ -80,6 +412,8 @@ def search_bing(query: str) -> str:
     console.print(Panel(f"Tool Invoked: Bing Search\nQuery: {query}", style="bold magenta"))
     return result_text
 
+tool_functions = {"search_azure_ai_search": search_azure_ai_search, "search_bing": search_bing}
+
 # ----------------------------
 # Define function schemas for OpenAI
 # ----------------------------
@@ -130,47 +464,302 @@ system_prompt = (
     "about current events or match incidents, use Bing Search. If both aspects are relevant, synthesize answers from both sources."
 )
 
+# ----------------------------
+# Local fast-path router
+# ----------------------------
+class RouteClassifier:
+    """Nearest-centroid classifier over hashed word and word-pair features, trained from the LLM's routing decisions.
+
+    The model is two small NumPy arrays (per-route feature sums and example counts), optionally saved to an .npz file.
+    It only routes once every route has min_examples logged decisions and the best route is clearly ahead.
+    Routes are tools only: a query the LLM answered without a tool is not learned, so the classifier never
+    predicts "direct_answer" and such queries keep going through the routing call.
+    """
+
+    def __init__(self, routes, n_features: int = 4096, path=None, min_examples: int = 20, min_similarity: float = 0.35, min_margin: float = 0.15, save_seconds: float = 30.0):
+        self.routes = list(routes)
+        self.n_features = n_features
+        self.path = path
+        self.save_seconds = save_seconds
+        self.min_examples = min_examples
+        self.min_similarity = min_similarity
+        self.min_margin = min_margin
+        self.sums = np.zeros((len(self.routes), n_features), dtype=np.float32)
+        self.counts = np.zeros(len(self.routes), dtype=np.int64)
+        self._lock = threading.Lock()
+        self._save_lock = threading.Lock()  # one writer of the model file at a time
+        self._dirty = False
+        self._saved_at = time.monotonic()
+        if path and os.path.exists(path):
+            with np.load(path) as model:
+                if list(model["routes"]) == self.routes and model["sums"].shape[1] == n_features:
+                    self.sums, self.counts = model["sums"], model["counts"]
+
+    def _features(self, query: str):
+        words = re.findall(r"\w+", query.lower())
+        vector = np.zeros(self.n_features, dtype=np.float32)
+        for token in words + [f"{a} {b}" for a, b in zip(words, words[1:])]:
+            vector[zlib.crc32(token.encode()) % self.n_features] += 1.0
+        return vector / (np.linalg.norm(vector) or 1.0)
+
+    def predict(self, query: str):
+        """Return (best route, similarity, margin); the route is None until every route has min_examples."""
+        with self._lock:
+            if self.counts.min() < self.min_examples:
+                return None, 0.0, 0.0
+            norms = np.linalg.norm(self.sums, axis=1, keepdims=True)
+            centroids = self.sums / np.where(norms == 0, 1.0, norms)
+        scores = centroids @ self._features(query)
+        best, second = np.argsort(scores)[::-1][:2]
+        return self.routes[best], float(scores[best]), float(scores[best] - scores[second])
+
+    def route(self, query: str):
+        """Return (route, similarity, margin); route is None when the classifier is not confident."""
+        route, similarity, margin = self.predict(query)
+        if similarity < self.min_similarity or margin < self.min_margin:
+            return None, similarity, margin
+        return route, similarity, margin
+
+    def learn(self, query: str, route: str) -> bool:
+        """Add one routing decision made by the LLM; returns True when a save() is due."""
+        if route not in self.routes:
+            return False
+        features = self._features(query)
+        with self._lock:
+            self.sums[self.routes.index(route)] += features
+            self.counts[self.routes.index(route)] += 1
+            self._dirty = True
+            return bool(self.path) and time.monotonic() - self._saved_at >= self.save_seconds
+
+    def save(self):
+        """Write the model to path if it changed since the last save. Blocking: run it off the event loop."""
+        with self._save_lock:
+            with self._lock:
+                if not self.path or not self._dirty:
+                    return
+                sums, counts = self.sums.copy(), self.counts.copy()
+                self._dirty = False
+                self._saved_at = time.monotonic()
+            tmp_path = f"{self.path}.tmp"
+            with open(tmp_path, "wb") as f:
+                np.savez(f, routes=np.array(self.routes), sums=sums, counts=counts)
+            os.replace(tmp_path, self.path)
+
+route_classifier = RouteClassifier(
+    [function["name"] for function in functions],
+    path=ROUTER_MODEL_PATH,
+    min_examples=ROUTER_MIN_EXAMPLES,
+    min_similarity=ROUTER_MIN_SIMILARITY,
+    min_margin=ROUTER_MIN_MARGIN,
+    save_seconds=ROUTER_SAVE_SECONDS,
+)
+# Decisions learned since the last debounced save are written by close_clients() at shutdown,
+# or at exit when the module is used outside chainlit
+atexit.register(route_classifier.save)
+_router_saves = set()  # in-flight saves, referenced until they finish
+
+def save_route_classifier():
+    """Save the router model in a worker thread without waiting for it."""
+    task = asyncio.create_task(asyncio.to_thread(route_classifier.save))
+    _router_saves.add(task)
+    task.add_done_callback(_router_saves.discard)
+
+# Routing decisions by route ("direct_answer" when the LLM used no tool) and routing LLM calls made vs. avoided (answer synthesis calls are not counted).
+routing_metrics = {
+    "queries": 0,
+    "local_routes": 0,
+    "llm_routes": 0,
+    "llm_calls": 0,
+    "llm_calls_avoided": 0,
+    "routes": {name: 0 for name in route_classifier.routes + ["direct_answer"]},
+}
+
+def record_route(route: str, local: bool):
+    routing_metrics["queries"] += 1
+    routing_metrics["routes"][route] += 1
+    if local:
+        routing_metrics["local_routes"] += 1
+        routing_metrics["llm_calls_avoided"] += 1
+    else:
+        routing_metrics["llm_routes"] += 1
+        routing_metrics["llm_calls"] += 1
+
+def routing_stats() -> dict:
+    """Routing metrics plus the percentage of LLM calls the local router avoided."""
+    total = routing_metrics["llm_calls"] + routing_metrics["llm_calls_avoided"]
+    return {**routing_metrics, "llm_calls_avoided_pct": 100.0 * routing_metrics["llm_calls_avoided"] / total if total else 0.0}
+
+# ----------------------------
+# Speculative retrieval
+# ----------------------------
+# Optionally starts the likely search while the routing call is still running. "wasted" counts
+# speculative searches whose result was not used (cancelled, wrong tool, or rewritten query).
+speculation_metrics = {"started": 0, "used": 0, "wasted": 0, "failed": 0, "skipped": 0}
+_speculations_in_flight = 0
+
+def _speculation_done(task: asyncio.Task):
+    global _speculations_in_flight
+    _speculations_in_flight -= 1
+    if not task.cancelled():
+        task.exception()  # mark failures as retrieved; they are handled when the result is used
+
+def start_speculative_retrieval(user_query: str) -> dict:
+    """Start the searches the routing call is likely to request, within the configured guards; returns {tool name: task}."""
+    global _speculations_in_flight
+    if SPECULATIVE_RETRIEVAL == "all":
+        candidates = list(SPECULATIVE_TOOLS)
+    elif SPECULATIVE_RETRIEVAL == "likely":
+        guess, similarity, _ = route_classifier.predict(user_query)
+        candidates = [guess] if guess in SPECULATIVE_TOOLS and similarity >= SPECULATION_MIN_SIMILARITY else []
+    else:
+        return {}
+    tasks = {}
+    for name in candidates:
+        if _speculations_in_flight >= SPECULATION_MAX_IN_FLIGHT:
+            speculation_metrics["skipped"] += 1
+            continue
+        _speculations_in_flight += 1
+        task = asyncio.create_task(tool_functions[name](query=user_query))
+        task.add_done_callback(_speculation_done)
+        tasks[name] = task
+        speculation_metrics["started"] += 1
+    return tasks
+
+def cancel_speculation(tasks: dict):
+    for task in tasks.values():
+        task.cancel()
+        speculation_metrics["wasted"] += 1
+    tasks.clear()
+
+async def use_speculation(task: asyncio.Task, user_query: str, query_for_function: str):
+    """Result of a confirmed speculative search, or None when it can't stand in for the requested one."""
+    user_words = set(user_query.lower().split())
+    function_words = set((query_for_function or "").lower().split())
+    overlap = len(user_words & function_words) / (len(user_words | function_words) or 1)
+    if overlap < SPECULATION_MIN_QUERY_OVERLAP:
+        task.cancel()
+        speculation_metrics["wasted"] += 1
+        return None
+    try:
+        result = await task
+    except Exception:
+        speculation_metrics["failed"] += 1
+        return None
+    speculation_metrics["used"] += 1
+    return result
+
+def speculation_stats() -> dict:
+    """Speculation metrics plus the share of started speculative searches that were wasted."""
+    started = speculation_metrics["started"]
+    return {**speculation_metrics, "wasted_pct": 100.0 * speculation_metrics["wasted"] / started if started else 0.0}
+
+# ----------------------------
+# Streaming helpers and time-to-first-token metrics
+# ----------------------------
+# Totals across answers; "last_*" describe the most recent answer.
+ttft_metrics = {"answers": 0, "total_seconds": 0.0, "max_seconds": 0.0, "last_seconds": None}
+
+async def stream_completion(answer_msg: cl.Message, timing: dict, **kwargs):
+    """Stream a chat completion into answer_msg token by token, assembling any function call from its deltas.
+
+    Returns (content, function_call) where function_call is None if the model answered directly.
+    """
+    stream = await openai_client.chat.completions.create(
+        model=AZURE_OPENAI_CHAT_COMPLETION_DEPLOYED_MODEL_NAME, stream=True, **kwargs
+    )
+    content = ""
+    function_call = {"name": "", "arguments": ""}
+    async for chunk in stream:
+        if not chunk.choices:  # e.g. Azure content filter results
+            continue
+        delta = chunk.choices[0].delta
+        if delta.function_call:
+            function_call["name"] += delta.function_call.name or ""
+            function_call["arguments"] += delta.function_call.arguments or ""
+        if delta.content:
+            if timing.get("first_token_at") is None:
+                record_first_token(timing)
+            content += delta.content
+            await answer_msg.stream_token(delta.content)
+    return content, (function_call if function_call["name"] else None)
+
+def record_first_token(timing: dict):
+    timing["first_token_at"] = time.perf_counter()
+    elapsed = timing["first_token_at"] - timing["started_at"]
+    ttft_metrics["answers"] += 1
+    ttft_metrics["total_seconds"] += elapsed
+    ttft_metrics["max_seconds"] = max(ttft_metrics["max_seconds"], elapsed)
+    ttft_metrics["last_seconds"] = elapsed
+    console.print(Panel(f"Time to first token: {elapsed:.2f}s", style="bold green"))
+
 # ----------------------------
 # Agent logic: process user query with OpenAI function calling
 # ----------------------------
-async def run_agent(user_query: str) -> str:
+async def run_agent(user_query: str, answer_msg: cl.Message):
+    """Answer user_query, streaming the final answer into answer_msg as it is generated."""
+    timing = {"started_at": time.perf_counter(), "first_token_at": None}
     messages = [
         {"role": "system", "content": system_prompt},
         {"role": "user", "content": user_query},
     ]
-    # Initial call with function definitions
-    response = openai_client.chat.completions.create(
-        model=AZURE_OPENAI_CHAT_COMPLETION_DEPLOYED_MODEL_NAME,
-        messages=messages,
-        functions=functions,
-        function_call="auto",
-    )
-    response_message = response.choices[0].message
+    # Fast path: skip the routing call when the local router is confident
+    route, similarity, margin = route_classifier.route(user_query)
+    speculative = {}
+    if route is not None:
+        content, function_call = "", {"name": route, "arguments": json.dumps({"query": user_query})}
+        record_route(route, local=True)
+        console.print(Panel(f"Routed locally: {route}\nSimilarity: {similarity:.2f} (margin {margin:.2f})", style="bold cyan"))
+    else:
+        # Initial call with function definitions, overlapped with any speculative searches
+        speculative = start_speculative_retrieval(user_query)
+        try:
+            content, function_call = await stream_completion(
+                answer_msg, timing, messages=messages, functions=functions, function_call="auto"
+            )
+        except BaseException:
+            cancel_speculation(speculative)
+            raise
+        record_route(function_call["name"] if function_call else "direct_answer", local=False)
+        if function_call is not None and route_classifier.learn(user_query, function_call["name"]):
+            save_route_classifier()
 
     # Check if the model decided to call a function
-    if response_message.function_call is not None:
-        function_name = response_message.function_call.name
-        function_args = json.loads(response_message.function_call.arguments)
+    if function_call is not None:
+        function_name = function_call["name"]
+        try:
+            function_args = json.loads(function_call["arguments"])
+        except BaseException:
+            cancel_speculation(speculative)
+            raise
         query_for_function = function_args.get("query")
+        # Keep the in-flight speculative search for the confirmed tool; drop the others
+        speculative_task = speculative.pop(function_name, None)
+        cancel_speculation(speculative)
+        function_response = None
+        if speculative_task is not None:
+            function_response = await use_speculation(speculative_task, user_query, query_for_function)
         # Invoke the appropriate tool
-        if function_name == "search_azure_ai_search":
-            function_response = search_azure_ai_search(query=query_for_function)
+        if function_response is not None:
+            console.print(Panel(f"Speculative result used: {function_name}\nQuery: {user_query}", style="bold cyan"))
+        elif function_name == "search_azure_ai_search":
+            function_response = await search_azure_ai_search(query=query_for_function)
         elif function_name == "search_bing":
-            function_response = search_bing(query=query_for_function)
+            function_response = await search_bing(query=query_for_function)
         else:
             function_response = "Function not found"
-        # Second call: send function response back for synthesis
-        second_response = openai_client.chat.completions.create(
-            model=AZURE_OPENAI_CHAT_COMPLETION_DEPLOYED_MODEL_NAME,
+        # Second call: send function response back for synthesis, streaming the answer
+        await answer_msg.stream_token(f"Function Called: {function_name}\nFinal Answer: ")
+        await stream_completion(
+            answer_msg,
+            timing,
             messages=messages + [
-                response_message,
+                {"role": "assistant", "content": content or None, "function_call": function_call},
                 {"role": "function", "name": function_name, "content": function_response},
             ],
         )
-        final_answer = second_response.choices[0].message.content
-        return f"Function Called: {function_name}\nFinal Answer: {final_answer}"
     else:
-        return response_message.content
+        # The direct answer has already been streamed into answer_msg
+        cancel_speculation(speculative)
 
 # ----------------------------
 # Chainlit event handlers
@@ -183,5 +772,34 @@ async def start_chat():
 
 @cl.on_message
 async def main(message: cl.Message):
-    answer = await run_agent(message.content)
-    await cl.Message(content=answer, author="Agent").send()
+    answer_msg = cl.Message(content="", author="Agent")
+    try:
+        await run_agent(message.content, answer_msg)
+    finally:
+        # Finalize answer_msg on every exit, including errors and a stopped task,
+        # so a partly streamed answer is not left open
+        if answer_msg.content:
+            await answer_msg.send()
+
+# on_app_shutdown exists from chainlit 2.6 (hasattr() cannot test for it: older versions raise KeyError
+# for unknown names); with older versions, such as the pinned 2.2.1, the server's lifespan is wrapped so
+# the clients are still closed when it stops
+if "on_app_shutdown" in vars(cl):
+    @cl.on_app_shutdown
+    async def shutdown():
+        await close_clients()
+else:
+    from chainlit.server import app as chainlit_app
+
+    _chainlit_lifespan = chainlit_app.router.lifespan_context
+
+    @contextlib.asynccontextmanager
+    async def lifespan_closing_clients(app):
+        async with _chainlit_lifespan(app):
+            try:
+                yield
+            finally:
+                # Inside chainlit's lifespan: it ends the process with os._exit()
+                await close_clients()
+
+    chainlit_app.router.lifespan_context = lifespan_closing_clients
@@ -0,0 +1,227 @@
+"""
+Recall and latency of memory retrieval over a synthetic fact corpus, keyword-only
+(what the memory index did before it had a vector field) versus hybrid keyword +
+vector retrieval. Everything runs locally; no number here comes from Azure.
+
+- "azure query" rows run the real AzureSearchMemoryBackend.search: its filter,
+  search text and VectorizedQuery are sent to a fake in-memory index that
+  applies them (word overlap standing in for BM25, exact cosine for HNSW, RRF
+  fusion). They check that the queries the backend builds retrieve by meaning;
+  they do not measure the service's ranking or latency.
+- "local" rows are a local simulation on memory_app.py's LocalMemoryBackend.
+  "binarized" rounds the vectors to one bit per dimension in Python before they
+  are stored, approximating binary quantization; the service's quantization and
+  rescoring are not reproduced.
+
+Every synthetic user has one fact per topic. Each fact is looked up twice: with
+a paraphrase that shares no words with it ("Where am I travelling?" for "Planning
+a trip to Japan") and with a keyword it contains. A small concept embedding
+stands in for the embedding deployment: words of the same topic share a
+dimension, any other word is hashed. It is built so that paraphrases land near
+their facts, so the hybrid rows show what vector retrieval adds when the model
+captures the paraphrase, not how well a real embedding model does.
+
+    python benchmarks/bench_memory_recall.py --users 50 --k 1
+"""
+
+import argparse
+import random
+import re
+import tempfile
+import time
+import uuid
+import zlib
+
+import numpy as np
+
+from types import SimpleNamespace
+
+from common import latency_summary
+
+import memory_app
+
+DIMENSIONS = 256
+
+CONCEPTS = {
+    "travel": ["trip", "travel", "travelling", "traveling", "vacation", "holiday", "journey", "flight"],
+    "pet": ["dog", "cat", "puppy", "kitten", "pet", "pets", "retriever", "terrier"],
+    "food": ["vegetarian", "vegan", "diet", "food", "eat", "meals", "cuisine"],
+    "allergy": ["allergic", "allergy", "allergies", "intolerant"],
+    "work": ["works", "work", "job", "engineer", "teacher", "nurse", "career", "profession"],
+    "family": ["daughters", "sons", "son", "daughter", "kids", "children", "family"],
+    "music": ["piano", "guitar", "violin", "instrument", "plays", "play", "music"],
+    "sport": ["marathon", "triathlon", "training", "exercise", "sport", "workout"],
+    "home": ["lives", "live", "apartment", "house", "home", "reside"],
+    "birthday": ["born", "birthday"],
+    "language": ["speaks", "fluent", "languages", "language", "speak"],
+    "reading": ["novels", "books", "reading", "read", "author"],
+}
+CONCEPT_INDEX = {word: i for i, words in enumerate(CONCEPTS.values()) for word in words}
+
+# (fact template, fillers, paraphrased question)
+TOPICS = [
+    ("Planning a trip to {} in the spring", ["Japan", "Italy", "Peru", "Kenya"], "Where am I travelling?"),
+    ("Has a golden retriever puppy named {}", ["Max", "Luna", "Biscuit", "Olive"], "What pet do I have?"),
+    ("Follows a strict vegetarian diet since {}", ["2015", "2018", "2020", "2022"], "What food do I eat?"),
+    ("Is allergic to {}", ["peanuts", "shellfish", "penicillin", "pollen"], "Any allergies I should mention?"),
+    ("Works as a {} engineer", ["software", "civil", "chemical", "aerospace"], "What is my job?"),
+    ("Has two daughters and a son in {}", ["Denver", "Austin", "Boston", "Miami"], "How many kids do I have?"),
+    ("Plays the {} on weekends", ["piano", "guitar", "violin", "cello"], "Which instrument do I play?"),
+    ("Is training for the {} marathon", ["Berlin", "Chicago", "London", "Tokyo"], "What exercise am I doing?"),
+    ("Lives in a small apartment in {}", ["Seattle", "Lisbon", "Montreal", "Oslo"], "Where is my home?"),
+    ("Was born on 12 March {}", ["1984", "1990", "1995", "2001"], "When is my birthday?"),
+    ("Speaks fluent {} and some French", ["Spanish", "German", "Portuguese", "Italian"], "Which languages do I know?"),
+    ("Enjoys mystery novels by {}", ["Christie", "Simenon", "Sayers", "Chandler"], "What books do I like?"),
+]
+
+
+def concept_embed(texts):
+    vectors = np.zeros((len(texts), DIMENSIONS), dtype=np.float32)
+    for row, text in enumerate(texts):
+        for token in re.findall(r"\w+", text.lower()):
+            if token in CONCEPT_INDEX:
+                vectors[row, CONCEPT_INDEX[token]] += 1.0
+            else:
+                bucket = zlib.crc32(token.encode("utf-8")) % (DIMENSIONS - len(CONCEPTS))
+                vectors[row, len(CONCEPTS) + bucket] += 0.3
+    return vectors.tolist()
+
+
+def binary_concept_embed(texts):
+    # One bit per dimension, as with binary quantization of the stored vectors
+    return (np.asarray(concept_embed(texts)) > 0).astype(np.float32).tolist()
+
+
+def word_overlap(query: str, content: str) -> int:
+    """Number of query words in content (stands in for BM25)."""
+    return len(set(re.findall(r"\w+", query.lower())) & set(re.findall(r"\w+", content.lower())))
+
+
+# ----------------------------
+# Fake memory index
+# ----------------------------
+class FakeMemoryIndex:
+    """
+    Answers the SearchClient.search calls AzureSearchMemoryBackend makes: the
+    thread/confidence filter, the search text and any VectorizedQuery, fused with
+    reciprocal rank fusion as the service does for hybrid queries.
+    """
+
+    FILTER = re.compile(r"thread_id eq '([^']*)' and confidence ge ([\d.]+)")
+
+    def __init__(self, facts, embed):
+        self.facts_by_thread = {}
+        for fact, vector in zip(facts, embed([fact["content"] for fact in facts])):
+            vector = np.asarray(vector, dtype=np.float32)
+            entry = (fact, vector / (np.linalg.norm(vector) or 1.0))
+            self.facts_by_thread.setdefault(fact["thread_id"], []).append(entry)
+        self.searches = 0
+        self.vector_searches = 0
+
+    def search(self, search_text, filter, top, vector_queries=None, **kwargs):
+        self.searches += 1
+        thread_id, min_confidence = self.FILTER.match(filter).groups()
+        candidates = [
+            (fact, vector)
+            for fact, vector in self.facts_by_thread.get(thread_id, [])
+            if fact["confidence"] >= float(min_confidence)
+        ]
+
+        rankings = []
+        keyword_scores = np.array([word_overlap(search_text, fact["content"]) for fact, _ in candidates])
+        rankings.append([i for i in np.argsort(-keyword_scores, kind="stable") if keyword_scores[i] > 0])
+        for vector_query in vector_queries or []:
+            self.vector_searches += 1
+            query = np.asarray(vector_query.vector, dtype=np.float32)
+            query /= np.linalg.norm(query) or 1.0
+            scores = np.array([vector @ query for _, vector in candidates])
+            rankings.append(list(np.argsort(-scores, kind="stable")[: vector_query.k_nearest_neighbors]))
+
+        fused = {}
+        for ranking in rankings:
+            for rank, i in enumerate(ranking):
+                fused[i] = fused.get(i, 0.0) + 1.0 / (memory_app.LocalMemoryBackend.RRF_K + rank + 1)
+        best = sorted(fused, key=lambda i: -fused[i])[:top]
+        return [dict(candidates[i][0]) for i in best]
+
+
+def azure_backend(index, embed):
+    """The real AzureSearchMemoryBackend on the fake index, with embed as the embedding deployment."""
+    memory_app.embed_texts = lambda texts: embed(texts) if embed else None
+    backend = memory_app.AzureSearchMemoryBackend(index, write_queue=None, vector_field="content_vector")
+    return lambda thread_id, query, k: backend.search(thread_id, query, limit=k)
+
+
+def build_corpus(users: int, seed: int = 7):
+    rng = random.Random(seed)
+    facts, queries = [], []
+    for user in range(users):
+        thread_id = f"thread_{user}"
+        for template, fillers, paraphrase in TOPICS:
+            filler = rng.choice(fillers)
+            fact = {
+                "id": str(uuid.uuid4()),
+                "thread_id": thread_id,
+                "content": template.format(filler),
+                "fact_type": "other",
+                "confidence": 1.0,
+                "timestamp": "2025-01-01T00:00:00",
+            }
+            facts.append(fact)
+            queries.append(("paraphrase", thread_id, paraphrase, fact["id"]))
+            queries.append(("keyword", thread_id, filler, fact["id"]))
+    return facts, queries
+
+
+def evaluate(search, queries, k: int):
+    hits = {"paraphrase": 0, "keyword": 0}
+    totals = {"paraphrase": 0, "keyword": 0}
+    latencies = []
+    for kind, thread_id, query, fact_id in queries:
+        start = time.perf_counter()
+        results = search(thread_id, query, k)
+        latencies.append(time.perf_counter() - start)
+        totals[kind] += 1
+        hits[kind] += any(result["id"] == fact_id for result in results)
+    return {kind: hits[kind] / totals[kind] for kind in hits}, latencies
+
+
+def local_backend(tmp_dir: str, facts, embed):
+    backend = memory_app.LocalMemoryBackend(tmp_dir, DIMENSIONS, embed=embed)
+    for fact in facts:
+        backend.store(dict(fact))
+    return lambda thread_id, query, k: backend.search(thread_id, query, limit=k)
+
+
+def main(args):
+    facts, queries = build_corpus(args.users)
+
+    # Nothing is queued: search results come from the index alone
+    memory_app.get_memory_write_queue = lambda: SimpleNamespace(overlay=lambda thread_id: (set(), {}))
+    index = FakeMemoryIndex(facts, concept_embed)
+
+    print(f"{len(facts)} facts, {len(queries)} queries, recall@{args.k}")
+    with tempfile.TemporaryDirectory() as tmp_hybrid, tempfile.TemporaryDirectory() as tmp_binary:
+        # Each mode is set up just before it runs: azure_backend replaces embed_texts
+        modes = [
+            ("azure query, keyword only", lambda: azure_backend(index, None)),
+            ("azure query, hybrid", lambda: azure_backend(index, concept_embed)),
+            ("local, hybrid", lambda: local_backend(tmp_hybrid, facts, concept_embed)),
+            ("local, hybrid, binarized", lambda: local_backend(tmp_binary, facts, binary_concept_embed)),
+        ]
+        for label, setup in modes:
+            recall, latencies = evaluate(setup(), queries, args.k)
+            print(
+                f"{label:<26} paraphrase {recall['paraphrase']:6.1%}   keyword {recall['keyword']:6.1%}   "
+                f"{latency_summary(latencies)}"
+            )
+
+    print(f"fake index: {index.searches} searches, {index.vector_searches} with a vector query")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--k", type=int, default=1, help="facts retrieved per query")
+    main(parser.parse_args())
@@ -0,0 +1,75 @@
+"""
+Model round trips and wall time per starter prompt for the reactive agent loop
+(run_multi_step_agent) and plan-then-execute mode (run_plan_and_execute_agent),
+with a scripted model and tools that take a fixed time (see common.py).
+
+The scripted model asks for the tools a starter needs one per round trip in the
+reactive loop, as the real model usually does for the compound "Mega Query",
+and plans all of them as independent steps in plan mode.
+
+    python benchmarks/bench_plan_mode.py --llm-latency 1.0 --tool-latency 0.5
+"""
+
+import argparse
+import asyncio
+import time
+
+from common import install_agent_stand_ins
+
+import app
+
+ALL_TOOLS = ["lookup_patient_data", "search_acc_guidelines", "search_bing_grounding"]
+
+# The starters' labels say which tool they exercise
+TOOLS_BY_LABEL_SUFFIX = {
+    "(NL2SQL)": ["lookup_patient_data"],
+    "(BING GROUNDING)": ["search_bing_grounding"],
+    "(AZURE AI SEARCH)": ["search_acc_guidelines"],
+    "(AGENTIC SEARCH)": ALL_TOOLS,
+}
+
+
+def tools_for_label(label: str) -> list:
+    for suffix, tools in TOOLS_BY_LABEL_SUFFIX.items():
+        if label.endswith(suffix):
+            return tools
+    return ALL_TOOLS
+
+
+async def main(args):
+    starters = await app.set_starters()
+    tools_by_question = {s.message: tools_for_label(s.label) for s in starters}
+    completions = install_agent_stand_ins(
+        app,
+        llm_latency=args.llm_latency,
+        tool_latency=args.tool_latency,
+        tools_for=lambda question: tools_by_question[question],
+    )
+
+    for starter in starters:
+        print(starter.label)
+        for mode, run_agent in (
+            ("reactive", app.run_multi_step_agent),
+            ("plan", app.run_plan_and_execute_agent),
+        ):
+            calls, seconds = [], []
+            for _ in range(args.repeats):
+                completions.calls = 0
+                start = time.perf_counter()
+                await run_agent(starter.message)
+                seconds.append(time.perf_counter() - start)
+                calls.append(completions.calls)
+            print(
+                f"  {mode:<9} {sum(calls) / len(calls):4.1f} model calls   "
+                f"{sum(seconds) / len(seconds):6.2f} s"
+            )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--llm-latency", type=float, default=1.0, help="seconds per model call")
+    parser.add_argument("--tool-latency", type=float, default=0.5, help="seconds per tool call")
+    parser.add_argument("--repeats", type=int, default=3)
+    asyncio.run(main(parser.parse_args()))
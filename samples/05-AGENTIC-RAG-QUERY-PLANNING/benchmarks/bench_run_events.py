@@ -0,0 +1,195 @@
+"""
+Turn latency and agent-service HTTP calls of memory_app.py's run handling: the
+old fixed 0.5 s polling loop, run_with_polling (exponential backoff) and
+run_with_streaming (run events), against a local fake of the agents API.
+
+Every fake run is queued, works, asks for one batch of tool outputs, works again
+and completes, taking the same server-side time for every strategy. "dead time"
+is the part of a turn spent noticing state changes rather than waiting on the
+service. Tool execution itself is not part of the measurement.
+
+    python benchmarks/bench_run_events.py --turns 10
+"""
+
+import argparse
+import time
+from types import SimpleNamespace
+
+from common import latency_summary
+
+import memory_app
+from azure.ai.projects.models import (
+    RequiredFunctionToolCall,
+    RequiredFunctionToolCallDetails,
+    SubmitToolOutputsAction,
+    SubmitToolOutputsDetails,
+)
+
+QUEUED_SECONDS = 0.2
+WORK_SECONDS = 0.8  # before the tool call and again after the outputs arrive
+
+REQUIRED_ACTION = SubmitToolOutputsAction(
+    submit_tool_outputs=SubmitToolOutputsDetails(
+        tool_calls=[
+            RequiredFunctionToolCall(
+                id="call_1",
+                function=RequiredFunctionToolCallDetails(
+                    name="retrieve_memories_func", arguments='{"query": ""}'
+                ),
+            )
+        ]
+    )
+)
+
+
+# ----------------------------
+# Fake agents API
+# ----------------------------
+class ScriptedRun:
+    """Server-side state of one run, advanced by the clock and by tool output submission."""
+
+    def __init__(self):
+        self.started_at = time.monotonic()
+        self.submitted_at = None
+
+    @property
+    def status(self) -> str:
+        now = time.monotonic()
+        if self.submitted_at is None:
+            elapsed = now - self.started_at
+            if elapsed < QUEUED_SECONDS:
+                return "queued"
+            return "in_progress" if elapsed < QUEUED_SECONDS + WORK_SECONDS else "requires_action"
+        return "in_progress" if now - self.submitted_at < WORK_SECONDS else "completed"
+
+    def snapshot(self, status=None):
+        status = status or self.status
+        return SimpleNamespace(
+            id="run_1",
+            thread_id="thread_1",
+            status=status,
+            required_action=REQUIRED_ACTION if status == "requires_action" else None,
+        )
+
+
+class FakeRunStream:
+    def __init__(self, agents, event_handler):
+        self.agents = agents
+        self.event_handler = event_handler
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+    def until_done(self):
+        run = self.agents.run
+        self.agents.emit(self.event_handler, "queued", 0)
+        self.agents.emit(self.event_handler, "in_progress", QUEUED_SECONDS)
+        self.agents.emit(self.event_handler, "requires_action", QUEUED_SECONDS + WORK_SECONDS)
+        if run.submitted_at is None:
+            raise RuntimeError("the event handler did not submit tool outputs")
+
+
+class FakeAgents:
+    """The agents operations memory_app uses, counting every call as one HTTP request."""
+
+    def __init__(self):
+        self.http_calls = 0
+        self.run = None
+
+    def emit(self, handler, status, at_seconds, since=None):
+        since = self.run.started_at if since is None else since
+        time.sleep(max(0.0, since + at_seconds - time.monotonic()))
+        handler.on_thread_run(self.run.snapshot(status))
+
+    def create_run(self, thread_id, assistant_id):
+        self.http_calls += 1
+        self.run = ScriptedRun()
+        return self.run.snapshot()
+
+    def get_run(self, thread_id, run_id):
+        self.http_calls += 1
+        return self.run.snapshot()
+
+    def submit_tool_outputs_to_run(self, thread_id, run_id, tool_outputs):
+        self.http_calls += 1
+        self.run.submitted_at = time.monotonic()
+
+    def create_stream(self, thread_id, assistant_id, event_handler):
+        self.http_calls += 1
+        self.run = ScriptedRun()
+        return FakeRunStream(self, event_handler)
+
+    def submit_tool_outputs_to_stream(self, thread_id, run_id, tool_outputs, event_handler):
+        # The rest of the run's events arrive on the response of this request
+        self.http_calls += 1
+        self.run.submitted_at = time.monotonic()
+        self.emit(event_handler, "in_progress", 0, since=self.run.submitted_at)
+        self.emit(event_handler, "completed", WORK_SECONDS, since=self.run.submitted_at)
+
+
+# ----------------------------
+# The run strategies
+# ----------------------------
+def run_with_fixed_polling(projects_client, thread_id, agent_id):
+    """The loop process_message used before: poll every 0.5 s."""
+    run = projects_client.agents.create_run(thread_id=thread_id, assistant_id=agent_id)
+    while run.status in ["queued", "in_progress", "requires_action"]:
+        time.sleep(0.5)
+        run = projects_client.agents.get_run(thread_id=thread_id, run_id=run.id)
+        if run.status == "requires_action" and isinstance(run.required_action, SubmitToolOutputsAction):
+            memory_app.process_function_calls(
+                thread_id, run.id, run.required_action.submit_tool_outputs.tool_calls
+            )
+    return run
+
+
+def main(args):
+    projects_client = SimpleNamespace(agents=FakeAgents())
+
+    # Outside Streamlit there is no session to log to, and the tools are not run
+    memory_app.add_log = lambda *args, **kwargs: None
+    memory_app.st = SimpleNamespace(session_state=SimpleNamespace(debug_mode=False))
+    memory_app.execute_function_calls = lambda tool_calls: [
+        {"tool_call_id": call.id, "output": "[]"} for call in tool_calls
+    ]
+    memory_app.process_function_calls = (
+        lambda thread_id, run_id, tool_calls, known_outputs=None: projects_client.agents.submit_tool_outputs_to_run(
+            thread_id=thread_id, run_id=run_id, tool_outputs=memory_app.execute_function_calls(tool_calls)
+        )
+    )
+
+    strategies = {
+        "fixed 0.5 s polling": lambda: run_with_fixed_polling(projects_client, "thread_1", "agent_1"),
+        "backoff polling": lambda: memory_app.run_with_polling(projects_client, "thread_1", "agent_1"),
+        "run events": lambda: memory_app.run_with_streaming(
+            projects_client,
+            "thread_1",
+            "agent_1",
+            memory_app.MemoryRunEventHandler(projects_client),
+        ),
+    }
+
+    server_seconds = QUEUED_SECONDS + 2 * WORK_SECONDS
+    for label, run_turn in strategies.items():
+        projects_client.agents.http_calls = 0
+        dead_times = []
+        for _ in range(args.turns):
+            start = time.perf_counter()
+            run = run_turn()
+            assert run.status == "completed", run.status
+            dead_times.append(time.perf_counter() - start - server_seconds)
+        print(
+            f"{label:<20} {projects_client.agents.http_calls / args.turns:5.1f} HTTP calls/turn   "
+            f"dead time {latency_summary(dead_times)}"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--turns", type=int, default=10)
+    main(parser.parse_args())
@@ -0,0 +1,103 @@
+"""
+Per-call search latency with a new SearchClient for every call (how the search
+tools used to work) versus the shared, pooled client from get_search_client().
+
+A local aiohttp server stands in for Azure AI Search. It speaks plain HTTP on
+localhost, so the numbers leave out the TLS handshake and network round trips
+that a new connection to the real service costs; the real gap is larger.
+
+    python benchmarks/bench_search_clients.py --calls 500 --concurrency 10
+"""
+
+import argparse
+import asyncio
+import time
+
+from aiohttp import web
+
+from common import latency_summary
+
+import app
+
+
+# ----------------------------
+# Azure AI Search stand-in
+# ----------------------------
+async def handle_search_request(request: web.Request) -> web.Response:
+    if request.path.endswith("/docs/$count"):
+        return web.Response(text="3", content_type="text/plain")
+    return web.json_response(
+        {
+            "value": [
+                {"@search.score": 1.0, "id": str(i), "content": "ACC guideline text"}
+                for i in range(3)
+            ]
+        }
+    )
+
+
+async def start_search_stand_in():
+    server = web.Application()
+    server.router.add_route("*", "/{tail:.*}", handle_search_request)
+    runner = web.AppRunner(server)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    host, port = runner.addresses[0][:2]
+    return runner, f"http://{host}:{port}"
+
+
+# ----------------------------
+# The two ways of querying
+# ----------------------------
+async def query_with_new_client(endpoint: str):
+    client = app._create_search_client(endpoint, app.SEARCH_INDEX_NAME)
+    async with client:
+        results = await client.search(search_text="hypertension", top=3)
+        return [doc async for doc in results]
+
+
+async def query_with_shared_client(endpoint: str):
+    client = await app.get_search_client(endpoint, app.SEARCH_INDEX_NAME)
+    results = await client.search(search_text="hypertension", top=3)
+    return [doc async for doc in results]
+
+
+async def measure(query, endpoint: str, calls: int, concurrency: int) -> list:
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+
+    async def timed_call():
+        async with semaphore:
+            start = time.perf_counter()
+            await query(endpoint)
+            latencies.append(time.perf_counter() - start)
+
+    await asyncio.gather(*(timed_call() for _ in range(calls)))
+    return latencies
+
+
+async def main(args):
+    runner, endpoint = await start_search_stand_in()
+    try:
+        # Warm up the interpreter and the shared client's pool
+        await measure(query_with_shared_client, endpoint, args.concurrency, args.concurrency)
+
+        for label, query in (
+            ("new client per call", query_with_new_client),
+            ("shared client", query_with_shared_client),
+        ):
+            latencies = await measure(query, endpoint, args.calls, args.concurrency)
+            print(f"{label:<22} {latency_summary(latencies)}")
+    finally:
+        await app.close_clients()
+        await runner.cleanup()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--calls", type=int, default=500)
+    parser.add_argument("--concurrency", type=int, default=10)
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,112 @@
+"""
+Per-query overhead of the NL2SQL tool's database access: a new SQLAlchemy engine
+(and connection) for every query, as lookup_patient_data used to do, versus a
+connection checked out of the shared, pooled engine through connect_sql().
+
+A SQLite file stands in for Azure SQL. Opening a SQLite connection is almost
+free, unlike the TLS handshake and login of an ODBC connection to Azure SQL, so
+every new connection is delayed by --connect-latency to stand in for that cost.
+
+    python benchmarks/bench_sql_engine.py --queries 200 --connect-latency 0.05
+"""
+
+import argparse
+import os
+import sqlite3
+import tempfile
+import time
+from contextlib import closing
+
+import sqlalchemy
+
+from common import latency_summary
+
+import app
+
+QUERY = "SELECT PatientID, Name, Age FROM PatientMedicalData WHERE Age > 70"
+
+
+def create_stand_in_database(path: str):
+    with closing(sqlite3.connect(path)) as connection, connection:
+        connection.execute(
+            "CREATE TABLE PatientMedicalData (PatientID INTEGER PRIMARY KEY, Name TEXT, Age INTEGER)"
+        )
+        connection.executemany(
+            "INSERT INTO PatientMedicalData (Name, Age) VALUES (?, ?)",
+            [(f"Patient {i}", 20 + i % 70) for i in range(1000)],
+        )
+
+
+def create_engine(uri: str, connect_latency: float, **kwargs):
+    engine = sqlalchemy.create_engine(uri, **kwargs)
+
+    @sqlalchemy.event.listens_for(engine, "connect")
+    def simulate_connection_setup(dbapi_connection, connection_record):
+        time.sleep(connect_latency)
+
+    return engine
+
+
+def query_with_new_engine(uri: str, connect_latency: float):
+    engine = create_engine(uri, connect_latency)
+    try:
+        with engine.connect() as connection:
+            return connection.exec_driver_sql(QUERY).fetchall()
+    finally:
+        engine.dispose()
+
+
+def query_with_shared_engine():
+    with app.connect_sql() as connection:
+        return connection.exec_driver_sql(QUERY).fetchall()
+
+
+def measure(query, queries: int) -> list:
+    latencies = []
+    for _ in range(queries):
+        start = time.perf_counter()
+        query()
+        latencies.append(time.perf_counter() - start)
+    return latencies
+
+
+def main(args):
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "patients.db")
+        create_stand_in_database(path)
+        uri = f"sqlite:///{path}"
+
+        # Same pool settings as the app's Azure SQL engine
+        app.sql_engine = create_engine(
+            uri,
+            args.connect_latency,
+            pool_size=app.AZURE_SQL_POOL_SIZE,
+            max_overflow=app.AZURE_SQL_MAX_OVERFLOW,
+            pool_pre_ping=True,
+            pool_recycle=app.AZURE_SQL_POOL_RECYCLE_SECONDS,
+        )
+        try:
+            before = measure(lambda: query_with_new_engine(uri, args.connect_latency), args.queries)
+            after = measure(query_with_shared_engine, args.queries)
+        finally:
+            app.sql_engine.dispose()
+
+    print(f"{'new engine per query':<22} {latency_summary(before)}")
+    print(f"{'shared engine':<22} {latency_summary(after)}")
+    metrics = app.sql_connection_metrics
+    print(
+        f"connection checkout: {metrics['acquisitions']} acquisitions, "
+        f"mean {metrics['total_seconds'] / metrics['acquisitions'] * 1000:.2f} ms, "
+        f"max {metrics['max_seconds'] * 1000:.2f} ms"
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument(
+        "--connect-latency", type=float, default=0.05, help="seconds added to every new connection"
+    )
+    main(parser.parse_args())
@@ -0,0 +1,57 @@
+"""
+Microbenchmark of per-batch memory tool dispatch in memory_app.py: rebuilding
+the memory functions and their FunctionTool schemas for every batch of tool
+calls (as process_function_calls used to) versus looking the callables up in the
+registry built once by get_memory_tool_registry().
+
+Only the dispatch is timed, not the tool calls themselves. The memory backend is
+the local store in a temporary folder, so no Azure resources are needed.
+
+    python benchmarks/bench_tool_registry.py --batches 2000
+"""
+
+import argparse
+import os
+import tempfile
+import timeit
+
+from common import SAMPLE_DIR  # noqa: F401  (puts memory_app on the import path)
+
+import memory_app
+from azure.ai.projects.models import FunctionTool
+
+BATCH = ["retrieve_memories_func", "store_memory_func", "update_memory_func"]
+
+
+def dispatch_rebuilding_tools():
+    memory_functions = memory_app.create_memory_functions()
+    FunctionTool(memory_functions)
+    functions = {func.__name__: func for func in memory_functions}
+    return [functions[name] for name in BATCH]
+
+
+def dispatch_from_registry():
+    functions = memory_app.get_memory_tool_registry()["functions"]
+    return [functions[name] for name in BATCH]
+
+
+def main(args):
+    with tempfile.TemporaryDirectory() as tmp:
+        os.environ["MEMORY_BACKEND"] = "local"
+        os.environ["MEMORY_LOCAL_PATH"] = tmp
+
+        for label, dispatch in (
+            ("rebuild per batch", dispatch_rebuilding_tools),
+            ("cached registry", dispatch_from_registry),
+        ):
+            dispatch()  # build the cached backend and registry outside the timing
+            seconds = timeit.timeit(dispatch, number=args.batches)
+            print(f"{label:<18} {seconds / args.batches * 1e6:10.1f} µs per batch")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--batches", type=int, default=2000)
+    main(parser.parse_args())
@@ -0,0 +1,124 @@
+"""
+Helpers shared by the benchmark scripts.
+
+The benchmarks run the sample's own code (app.py, memory_app.py) against local
+stand-ins for the Azure services, so they need the sample's requirements
+installed but no Azure resources. Run them from the sample folder, e.g.
+
+    python benchmarks/bench_search_clients.py
+"""
+
+import asyncio
+import json
+import math
+import os
+import sys
+import time
+from types import SimpleNamespace
+
+# Make app.py and memory_app.py importable from the benchmarks folder
+SAMPLE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if SAMPLE_DIR not in sys.path:
+    sys.path.insert(0, SAMPLE_DIR)
+
+
+def percentile(values, pct: float) -> float:
+    """Nearest-rank percentile of a non-empty list of numbers."""
+    ordered = sorted(values)
+    rank = max(1, math.ceil(pct / 100 * len(ordered)))
+    return ordered[rank - 1]
+
+
+def latency_summary(seconds) -> str:
+    """One-line p50/p99/mean summary of a list of durations in seconds."""
+    return (
+        f"p50 {percentile(seconds, 50) * 1000:8.1f} ms   "
+        f"p99 {percentile(seconds, 99) * 1000:8.1f} ms   "
+        f"mean {sum(seconds) / len(seconds) * 1000:8.1f} ms   "
+        f"n={len(seconds)}"
+    )
+
+
+# ----------------------------
+# Stand-ins for the chat model and the agent's tools
+# ----------------------------
+def _chunk(**delta):
+    delta = {"content": None, "tool_calls": None, **delta}
+    return SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(**delta))])
+
+
+async def _stream(chunks):
+    for chunk in chunks:
+        yield chunk
+
+
+class ScriptedChatCompletions:
+    """
+    Stands in for openai_client.chat.completions. Every call is counted and takes
+    `latency` seconds, like one model round trip. tools_for(question) names the
+    tools a question needs: calls that offer tools ask for the next one without a
+    result yet (one per round trip, as the reactive agent usually goes), JSON-mode
+    calls return a plan running all of them in parallel, and anything else
+    streams a short answer.
+    """
+
+    def __init__(self, latency: float, tools_for):
+        self.latency = latency
+        self.tools_for = tools_for
+        self.calls = 0
+
+    async def create(self, messages, stream=False, tools=None, response_format=None, **kwargs):
+        self.calls += 1
+        await asyncio.sleep(self.latency)
+        question = next(m["content"] for m in messages if m["role"] == "user")
+        needed = self.tools_for(question)
+
+        if response_format is not None:
+            steps = [
+                {"id": f"s{i + 1}", "tool": name, "arguments": {"query": question}, "depends_on": []}
+                for i, name in enumerate(needed)
+            ]
+            message = SimpleNamespace(content=json.dumps({"steps": steps}))
+            return SimpleNamespace(choices=[SimpleNamespace(message=message)])
+
+        answered = {m.get("name") for m in messages if m["role"] == "tool"}
+        remaining = [name for name in needed if name not in answered] if tools else []
+        if remaining:
+            tool_call = SimpleNamespace(
+                index=0,
+                id=f"call_{self.calls}",
+                function=SimpleNamespace(name=remaining[0], arguments=json.dumps({"query": question})),
+            )
+            return _stream([_chunk(tool_calls=[tool_call])])
+        return _stream([_chunk(content=word) for word in ("Here ", "is ", "the ", "answer.")])
+
+
+def install_agent_stand_ins(app, llm_latency: float, tool_latency: float, tools_for):
+    """
+    Points app.py's model client and tools at local stand-ins (the blocking tools
+    still block a worker thread, the search tool awaits) and opens a Chainlit
+    context so the agent's messages and steps can be created outside a server.
+    Returns the ScriptedChatCompletions so callers can count round trips.
+    """
+    from chainlit.context import init_http_context
+
+    completions = ScriptedChatCompletions(llm_latency, tools_for)
+    app.openai_client = SimpleNamespace(chat=SimpleNamespace(completions=completions))
+
+    def lookup_patient_data(query: str) -> str:
+        time.sleep(tool_latency)
+        return "PatientID,Name,Age\n1042,Gloria Paul,79"
+
+    async def search_acc_guidelines(query: str) -> str:
+        await asyncio.sleep(tool_latency)
+        return "ACC guideline excerpt"
+
+    def search_bing_grounding(query: str) -> str:
+        time.sleep(tool_latency)
+        return "FDA update summary"
+
+    app.lookup_patient_data = lookup_patient_data
+    app.search_acc_guidelines = search_acc_guidelines
+    app.search_bing_grounding = search_bing_grounding
+    init_http_context()
+    return completions
@@ -0,0 +1,67 @@
+"""
+Load test for the async agent loop: N chat sessions answer a two-tool question
+through run_multi_step_agent at the same time, on one event loop, with a
+scripted model and tools that take a fixed time (see common.py).
+
+If the loop blocked on the model or the tools, N sessions would take about N
+times as long as one; with the async path the wall time stays close to a single
+session until the worker threads used by the blocking SQL and Bing tools run out.
+
+    python benchmarks/load_test.py --sessions 1 10 25 50
+"""
+
+import argparse
+import asyncio
+import time
+
+from common import install_agent_stand_ins, latency_summary
+
+import app
+
+QUESTION = (
+    "Confirm Gloria Paul's medical details from the database and check the ACC "
+    "guidelines for hyperlipidemia."
+)
+
+
+async def run_session(latencies: list):
+    start = time.perf_counter()
+    await app.run_multi_step_agent(QUESTION)
+    latencies.append(time.perf_counter() - start)
+
+
+async def main(args):
+    completions = install_agent_stand_ins(
+        app,
+        llm_latency=args.llm_latency,
+        tool_latency=args.tool_latency,
+        tools_for=lambda question: ["lookup_patient_data", "search_acc_guidelines"],
+    )
+
+    # One session on its own is the baseline (and warms everything up)
+    latencies = []
+    await run_session(latencies)
+    single = latencies[0]
+
+    for sessions in args.sessions:
+        completions.calls = 0
+        latencies = []
+        start = time.perf_counter()
+        await asyncio.gather(*(run_session(latencies) for _ in range(sessions)))
+        wall = time.perf_counter() - start
+
+        print(
+            f"{sessions:>4} sessions   wall {wall:6.2f} s "
+            f"(serialized: {single * sessions:6.2f} s)   "
+            f"{completions.calls} model calls   per session {latency_summary(latencies)}"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--sessions", type=int, nargs="+", default=[1, 10, 25, 50])
+    parser.add_argument("--llm-latency", type=float, default=0.5, help="seconds per model call")
+    parser.add_argument("--tool-latency", type=float, default=0.3, help="seconds per tool call")
+    asyncio.run(main(parser.parse_args()))
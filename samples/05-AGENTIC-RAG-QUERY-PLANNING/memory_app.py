@@ -14,12 +14,22 @@ USAGE:
 
     Before running the sample:
 
-    pip install azure-ai-projects azure-identity azure-search-documents pydantic streamlit
+    pip install azure-ai-projects azure-identity azure-search-documents numpy openai pydantic streamlit
 
     Set these environment variables with your own values:
     1) AZURE_CONNECTION_STRING - The project connection string
     2) AZURE_SEARCH_SERVICE_ENDPOINT - The endpoint of your Azure Search service
     3) AZURE_SEARCH_ADMIN_KEY - The admin key for your Azure Search service
+
+    Optionally, to enable hybrid (keyword + vector) memory retrieval:
+    4) AZURE_OPENAI_ENDPOINT - The endpoint of your Azure OpenAI resource
+    5) AZURE_OPENAI_API_KEY - The API key for your Azure OpenAI resource
+    6) AZURE_OPENAI_EMBEDDING_DEPLOYMENT - The name of your embedding model deployment
+
+    To keep memories on local disk instead of Azure AI Search (single node only):
+    7) MEMORY_BACKEND=local - Optionally with MEMORY_LOCAL_PATH (default .memory_store)
+    The local store searches by a brute-force scan of the thread's facts; there is
+    no approximate nearest neighbour index, which suits per-user memory sizes.
 """
 
 import os
@@ -27,16 +37,26 @@ import json
 import time
 import uuid
 import re
+import zlib
+import hashlib
+import numpy as np
 import streamlit as st
 from datetime import datetime, UTC
 from typing import List, Dict, Any, Optional, Union, Set, Callable
 from enum import Enum
 from pydantic import BaseModel, Field
+from openai import AzureOpenAI
+import atexit
 import threading
+import itertools
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
 
 from azure.identity import DefaultAzureCredential
 from azure.ai.projects import AIProjectClient
 from azure.ai.projects.models import (
+    AgentEventHandler,
     FunctionTool,
     ToolSet,
     RequiredFunctionToolCall,
@@ -45,8 +65,9 @@ from azure.ai.projects.models import (
     RunStatus,
     ResponseFormatJsonSchema,
     ResponseFormatJsonSchemaType,
+    ListSortOrder,
 )
-from azure.search.documents import SearchClient
+from azure.search.documents import IndexDocumentsBatch, SearchClient
 from azure.search.documents.indexes import SearchIndexClient
 from azure.search.documents.indexes.models import (
     SearchIndex,
@@ -54,8 +75,16 @@ from azure.search.documents.indexes.models import (
     SearchFieldDataType,
     SimpleField,
     SearchableField,
+    VectorSearch,
+    VectorSearchProfile,
+    HnswAlgorithmConfiguration,
+    HnswParameters,
+    BinaryQuantizationCompression,
+    ScalarQuantizationCompression,
 )
+from azure.search.documents.models import VectorizedQuery
 from azure.core.credentials import AzureKeyCredential
+from azure.core.exceptions import ResourceNotFoundError
 
 # Configuration
 def get_config():
@@ -64,8 +93,108 @@ def get_config():
         "AZURE_SEARCH_ENDPOINT": os.getenv("AZURE_SEARCH_SERVICE_ENDPOINT"),
         "AZURE_SEARCH_ADMIN_KEY": os.getenv("AZURE_SEARCH_ADMIN_KEY"),
         "MEMORY_INDEX_NAME": "fact-memory-index",
+        # "azure" (Azure AI Search index) or "local" (in-process store persisted on disk)
+        "MEMORY_BACKEND": os.getenv("MEMORY_BACKEND", "azure").lower(),
+        "MEMORY_LOCAL_PATH": os.getenv("MEMORY_LOCAL_PATH", ".memory_store"),
+        # Size of the hashed embedding used by the local backend without an embedding deployment
+        "MEMORY_LOCAL_DIMENSIONS": int(os.getenv("MEMORY_LOCAL_DIMENSIONS", "256")),
+        # Threads with more facts than this are retrieved from the backend instead of the session cache
+        "FACT_CACHE_MAX_FACTS": int(os.getenv("MEMORY_FACT_CACHE_MAX_FACTS", "200")),
+        # Maximum number of memory tool calls executed concurrently
+        "TOOL_CALL_WORKERS": int(os.getenv("MEMORY_TOOL_CALL_WORKERS", "4")),
+        # Vector retrieval is enabled when an embedding deployment is configured
+        "AZURE_OPENAI_ENDPOINT": os.getenv("AZURE_OPENAI_ENDPOINT"),
+        "AZURE_OPENAI_API_KEY": os.getenv("AZURE_OPENAI_API_KEY"),
+        "AZURE_OPENAI_API_VERSION": os.getenv("AZURE_OPENAI_API_VERSION", "2024-10-21"),
+        "EMBEDDING_DEPLOYMENT": os.getenv("AZURE_OPENAI_EMBEDDING_DEPLOYMENT"),
+        # Must match the output size of the embedding deployment
+        "EMBEDDING_DIMENSIONS": int(os.getenv("MEMORY_EMBEDDING_DIMENSIONS", "1536")),
+        "MEMORY_VECTOR_FIELD": "content_vector",
+        # "binary", "scalar" or "none"
+        "MEMORY_VECTOR_COMPRESSION": os.getenv("MEMORY_VECTOR_COMPRESSION", "binary").lower(),
+        # Stream run events (falls back to polling with exponential backoff)
+        "RUN_STREAMING": os.getenv("MEMORY_RUN_STREAMING", "true").lower() == "true",
+        # Polling starts at the old fixed interval and slows down while a run is working
+        "RUN_POLL_MIN_SECONDS": 0.5,
+        "RUN_POLL_MAX_SECONDS": 2.0,
+        "RUN_POLL_BACKOFF": 1.5,
+        # Maximum number of entries kept in the memory operations log
+        "MEMORY_OPS_CAPACITY": int(os.getenv("MEMORY_OPS_CAPACITY", "500")),
+        # Memory writes are batched; a batch is sent when this many are queued or
+        # after this many seconds, whichever comes first
+        "WRITE_BATCH_SIZE": int(os.getenv("MEMORY_WRITE_BATCH_SIZE", "50")),
+        "WRITE_FLUSH_SECONDS": float(os.getenv("MEMORY_WRITE_FLUSH_SECONDS", "1.0")),
     }
 
+# Bounded log of memory operations
+class MemoryOpsLog:
+    """
+    Fixed-capacity ring buffer of log entries. Every entry gets a sequence number,
+    so the entries logged between two points (e.g. two chat messages) can be sliced
+    out directly. Memory highlights and retrievals, the views the UI reads, are also
+    indexed by type; an entry leaves its views when the ring overwrites it, so they
+    never hold more than the buffer does.
+    """
+
+    INDEXED_TYPES = ("memory_highlight", "retrieval")
+
+    def __init__(self, capacity=500):
+        self.capacity = capacity
+        self._entries = [None] * capacity
+        self._next_seq = 0
+        self._by_type = {log_type: deque() for log_type in self.INDEXED_TYPES}
+        self._lock = threading.Lock()  # tool calls log from worker threads
+
+    @staticmethod
+    def _views(entry):
+        """Indexed types an entry belongs to"""
+        if entry.get("type") != "memory_highlight":
+            return ()
+        if "MEMORIES RETRIEVED" in entry.get("message", ""):
+            return ("memory_highlight", "retrieval")
+        return ("memory_highlight",)
+
+    @property
+    def next_seq(self):
+        """Sequence number the next entry will get"""
+        return self._next_seq
+
+    def append(self, entry):
+        with self._lock:
+            slot = self._next_seq % self.capacity
+            evicted = self._entries[slot]
+            if evicted is not None:
+                # The oldest entry overall is also the oldest in each of its views
+                for log_type in self._views(evicted):
+                    self._by_type[log_type].popleft()
+
+            entry["seq"] = self._next_seq
+            self._entries[slot] = entry
+            self._next_seq += 1
+            for log_type in self._views(entry):
+                self._by_type[log_type].append(entry)
+
+    def __len__(self):
+        return min(self._next_seq, self.capacity)
+
+    def __iter__(self):
+        for seq in range(self._next_seq - len(self), self._next_seq):
+            yield self._entries[seq % self.capacity]
+
+    def between(self, start_seq, end_seq):
+        """Entries with start_seq <= seq < end_seq that are still in the buffer"""
+        start_seq = max(start_seq, self._next_seq - len(self))
+        end_seq = min(end_seq, self._next_seq)
+        return [self._entries[seq % self.capacity] for seq in range(start_seq, end_seq)]
+
+    def recent(self, log_type, k=None):
+        """The k most recent entries of an indexed type (all if k is None), oldest first"""
+        with self._lock:
+            entries = self._by_type[log_type]
+            if k is None:
+                return list(entries)
+            return list(itertools.islice(reversed(entries), k))[::-1]
+
 # Initialize session state
 def init_session_state():
     """Initialize session state variables"""
@@ -73,10 +202,19 @@ def init_session_state():
         st.session_state.messages = []
     
     if "memory_ops" not in st.session_state:
-        st.session_state.memory_ops = []
+        st.session_state.memory_ops = MemoryOpsLog(get_config()["MEMORY_OPS_CAPACITY"])
         
     if "thread_id" not in st.session_state:
         st.session_state.thread_id = None
+
+    if "fact_cache" not in st.session_state:
+        st.session_state.fact_cache = None
+
+    if "write_failure_seq" not in st.session_state:
+        st.session_state.write_failure_seq = 0
+
+    if "last_message_ids" not in st.session_state:
+        st.session_state.last_message_ids = {}
         
     if "agent_id" not in st.session_state:
         st.session_state.agent_id = None
@@ -92,6 +230,13 @@ def init_session_state():
         
     if "show_facts" not in st.session_state:
         st.session_state.show_facts = False
+
+    if "fact_page" not in st.session_state:
+        st.session_state.fact_page = None
+
+    # (continuation token, start) of the fact pages before the current one
+    if "fact_page_tokens" not in st.session_state:
+        st.session_state.fact_page_tokens = []
         
     if "show_retrievals" not in st.session_state:
         st.session_state.show_retrievals = False
@@ -104,11 +249,14 @@ def init_session_state():
 def initialize_clients():
     config = get_config()
     
-    search_client = SearchClient(
-        endpoint=config["AZURE_SEARCH_ENDPOINT"],
-        index_name=config["MEMORY_INDEX_NAME"],
-        credential=AzureKeyCredential(config["AZURE_SEARCH_ADMIN_KEY"]),
-    )
+    # The local memory backend does not need Azure AI Search
+    search_client = None
+    if config["AZURE_SEARCH_ENDPOINT"]:
+        search_client = SearchClient(
+            endpoint=config["AZURE_SEARCH_ENDPOINT"],
+            index_name=config["MEMORY_INDEX_NAME"],
+            credential=AzureKeyCredential(config["AZURE_SEARCH_ADMIN_KEY"]),
+        )
 
     projects_client = AIProjectClient.from_connection_string(
         credential=DefaultAzureCredential(),
@@ -117,6 +265,70 @@ def initialize_clients():
     
     return search_client, projects_client
 
+@st.cache_resource
+def get_embedding_client():
+    """Azure OpenAI client used for memory embeddings, or None when vector retrieval is off"""
+    config = get_config()
+    if not (config["EMBEDDING_DEPLOYMENT"] and config["AZURE_OPENAI_ENDPOINT"]):
+        return None
+    return AzureOpenAI(
+        api_key=config["AZURE_OPENAI_API_KEY"],
+        api_version=config["AZURE_OPENAI_API_VERSION"],
+        azure_endpoint=config["AZURE_OPENAI_ENDPOINT"],
+    )
+
+def embed_texts(texts):
+    """Embed a batch of texts in one request; returns None if vector retrieval is off or fails"""
+    client = get_embedding_client()
+    if client is None or not texts:
+        return None
+    try:
+        response = client.embeddings.create(
+            model=get_config()["EMBEDDING_DEPLOYMENT"], input=list(texts)
+        )
+        return [item.embedding for item in sorted(response.data, key=lambda item: item.index)]
+    except Exception as e:
+        # The write queue embeds on its own thread, outside any session
+        if get_script_run_ctx() is not None:
+            add_log(f"⚠️ Error embedding memory content: {e}", "warning")
+        return None
+
+def build_vector_search(config):
+    """Vector field and HNSW/quantization settings for the memory index"""
+    compression_name = None
+    compressions = []
+    if config["MEMORY_VECTOR_COMPRESSION"] == "binary":
+        compression_name = "memory-binary-compression"
+        compressions.append(BinaryQuantizationCompression(compression_name=compression_name))
+    elif config["MEMORY_VECTOR_COMPRESSION"] == "scalar":
+        compression_name = "memory-scalar-compression"
+        compressions.append(ScalarQuantizationCompression(compression_name=compression_name))
+
+    vector_search = VectorSearch(
+        algorithms=[
+            HnswAlgorithmConfiguration(
+                name="memory-hnsw",
+                parameters=HnswParameters(m=4, ef_construction=400, ef_search=500, metric="cosine"),
+            )
+        ],
+        profiles=[
+            VectorSearchProfile(
+                name="memory-vector-profile",
+                algorithm_configuration_name="memory-hnsw",
+                compression_name=compression_name,
+            )
+        ],
+        compressions=compressions,
+    )
+    vector_field = SearchField(
+        name=config["MEMORY_VECTOR_FIELD"],
+        type=SearchFieldDataType.Collection(SearchFieldDataType.Single),
+        searchable=True,
+        vector_search_dimensions=config["EMBEDDING_DIMENSIONS"],
+        vector_search_profile_name="memory-vector-profile",
+    )
+    return vector_field, vector_search
+
 # Define Pydantic models for structured outputs
 class FactType(str, Enum):
     PERSONAL = "personal"
@@ -168,67 +380,113 @@ def extract_text(content):
     # Default fallback
     return str(content)
 
-# Ensure memory index exists
-def ensure_memory_index_exists():
-    """Create or update the memory index if it doesn't exist"""
-    try:
-        config = get_config()
-        # Initialize the search index client
-        index_client = SearchIndexClient(
-            endpoint=config["AZURE_SEARCH_ENDPOINT"],
-            credential=AzureKeyCredential(config["AZURE_SEARCH_ADMIN_KEY"]),
-        )
-
-        # Check if index exists
-        index_exists = False
-        try:
-            index_info = index_client.get_index(name=config["MEMORY_INDEX_NAME"])
-            index_exists = True
-            add_log(f"✅ Memory index '{config['MEMORY_INDEX_NAME']}' already exists", "system")
-        except:
-            add_log(f"🔧 Creating memory index '{config['MEMORY_INDEX_NAME']}'...", "system")
-
-        # If index doesn't exist, create it
-        if not index_exists:
-            # Define the index fields
-            fields = [
-                SimpleField(name="id", type=SearchFieldDataType.String, key=True),
-                SearchableField(name="content", type=SearchFieldDataType.String),
-                SimpleField(
-                    name="thread_id", type=SearchFieldDataType.String, filterable=True
-                ),
-                SimpleField(
-                    name="fact_type", type=SearchFieldDataType.String, filterable=True
-                ),
-                SimpleField(
-                    name="confidence", type=SearchFieldDataType.Double, filterable=True
-                ),
-                SimpleField(
-                    name="timestamp",
-                    type=SearchFieldDataType.DateTimeOffset,
-                    filterable=True,
-                    sortable=True,
-                ),
-            ]
+# Memory index schema
+def build_memory_index(config):
+    """The memory index definition this app expects"""
+    fields = [
+        SimpleField(name="id", type=SearchFieldDataType.String, key=True),
+        SearchableField(name="content", type=SearchFieldDataType.String),
+        SimpleField(
+            name="thread_id", type=SearchFieldDataType.String, filterable=True
+        ),
+        SimpleField(
+            name="fact_type", type=SearchFieldDataType.String, filterable=True
+        ),
+        SimpleField(
+            name="confidence", type=SearchFieldDataType.Double, filterable=True
+        ),
+        SimpleField(
+            name="timestamp",
+            type=SearchFieldDataType.DateTimeOffset,
+            filterable=True,
+            sortable=True,
+        ),
+    ]
+
+    # Optional vector field for hybrid retrieval
+    vector_search = None
+    if get_embedding_client() is not None:
+        vector_field, vector_search = build_vector_search(config)
+        fields.append(vector_field)
+
+    return SearchIndex(
+        name=config["MEMORY_INDEX_NAME"], fields=fields, vector_search=vector_search
+    )
 
-            # Create the index definition
-            index = SearchIndex(name=config["MEMORY_INDEX_NAME"], fields=fields)
+def schema_fingerprint(fields):
+    """Stable hash of the field attributes that affect how memories are written and queried"""
+    signature = sorted(
+        [
+            f.name,
+            str(f.type),
+            bool(f.key),
+            bool(f.searchable),
+            bool(f.filterable),
+            bool(f.sortable),
+            f.vector_search_dimensions,
+            f.vector_search_profile_name,
+        ]
+        for f in fields
+    )
+    return hashlib.sha256(json.dumps(signature).encode("utf-8")).hexdigest()[:16]
 
-            # Create the index
-            index_client.create_or_update_index(index)
+# Create or verify the memory index once per process
+@st.cache_resource
+def bootstrap_memory_index():
+    """Create the memory index or migrate it to the expected schema; returns its fingerprint"""
+    config = get_config()
+    index_name = config["MEMORY_INDEX_NAME"]
+    index_client = SearchIndexClient(
+        endpoint=config["AZURE_SEARCH_ENDPOINT"],
+        credential=AzureKeyCredential(config["AZURE_SEARCH_ADMIN_KEY"]),
+    )
+    expected = build_memory_index(config)
+    expected_fingerprint = schema_fingerprint(expected.fields)
 
-            add_log(f"✅ Created memory index '{config['MEMORY_INDEX_NAME']}'", "system")
+    try:
+        live = index_client.get_index(name=index_name)
+    except ResourceNotFoundError:
+        add_log(f"🔧 Creating memory index '{index_name}'...", "system")
+        index_client.create_or_update_index(expected)
+        add_log(f"✅ Created memory index '{index_name}'", "system")
+        return expected_fingerprint
+
+    if schema_fingerprint(live.fields) == expected_fingerprint:
+        add_log(f"✅ Memory index '{index_name}' already exists", "system")
+        return expected_fingerprint
+
+    # Schema drift: new fields can be added in place, changed fields need a rebuild
+    live_fields = {f.name: f for f in live.fields}
+    changed = [
+        f.name for f in expected.fields
+        if f.name in live_fields and schema_fingerprint([f]) != schema_fingerprint([live_fields[f.name]])
+    ]
+    if changed:
+        raise RuntimeError(
+            f"Memory index '{index_name}' has incompatible definitions for {', '.join(changed)}; "
+            f"delete and recreate the index to migrate it"
+        )
 
-        # Test search client connection
-        search_client, _ = initialize_clients()
-        add_log(f"✅ Testing search client connection...", "system")
-        try:
-            test_result = search_client.search(search_text="*", top=1)
-            list(test_result)  # Force evaluation
-            add_log(f"✅ Search client connection verified", "system")
-        except Exception as e:
-            add_log(f"❌ ERROR with search client: {e}", "error")
+    missing = [f for f in expected.fields if f.name not in live_fields]
+    if missing:
+        live.fields.extend(missing)
+        if any(f.vector_search_profile_name for f in missing):
+            live.vector_search = expected.vector_search
+        index_client.create_or_update_index(live)
+        add_log(
+            f"🔧 Migrated memory index '{index_name}': added {', '.join(f.name for f in missing)}",
+            "system",
+        )
+    else:
+        add_log(f"✅ Memory index '{index_name}' already exists (with extra fields)", "system")
+    return schema_fingerprint(live.fields)
 
+# Ensure memory index exists
+def ensure_memory_index_exists():
+    """Make sure the memory index exists with the expected schema (checked once per process)"""
+    try:
+        fingerprint = bootstrap_memory_index()
+        add_log(f"✅ Memory index ready (schema {fingerprint})", "system")
         return True
     except Exception as e:
         add_log(f"❌ ERROR creating memory index: {e}", "error")
@@ -251,10 +509,726 @@ def add_log(message, log_type="info", additional_data=None):
         
     st.session_state.memory_ops.append(log_entry)
 
+# Write-behind queue for memory documents
+class MemoryWriteQueue:
+    """
+    Coalesces memory store/update/delete operations per document ID and sends them
+    to the search index as batched index_documents calls, flushing whenever
+    max_batch_size operations are pending or every flush_seconds. Queued writes, and
+    flushed writes for visibility_seconds afterwards (the index is near-real-time),
+    are exposed through overlay() so reads see their own writes. Writes that fail
+    with a transient error are queued again, up to max_attempts sends; writes that
+    still fail are dropped and recorded in failures.
+    """
+
+    # Per-document status codes Azure AI Search documents as safe to retry
+    RETRYABLE_STATUS_CODES = (409, 422, 429, 503)
+
+    def __init__(self, search_client, max_batch_size=50, flush_seconds=1.0, visibility_seconds=2.0,
+                 embed=None, vector_field=None, max_attempts=3):
+        self.search_client = search_client
+        self.embed = embed
+        self.vector_field = vector_field
+        self.max_batch_size = max_batch_size
+        self.flush_seconds = flush_seconds
+        self.visibility_seconds = visibility_seconds
+        self.max_attempts = max_attempts
+        self.flushes = 0
+        self.documents_flushed = 0
+        self.documents_retried = 0
+        self.documents_failed = 0
+        self.last_error = None
+        self.failures = deque(maxlen=100)  # dropped writes, oldest first
+        self._failure_seq = itertools.count(1)
+        self._pending = OrderedDict()  # id -> (action, doc)
+        self._recent = {}  # id -> (action, doc, visible_until)
+        self._attempts = {}  # id -> failed sends of the pending write
+        self._condition = threading.Condition()
+        self._flush_lock = threading.Lock()  # keeps batches for the same document in order
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name="memory-write-queue", daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    def enqueue(self, action, doc):
+        """Queue an 'upload', 'merge' or 'delete' for doc, coalescing with any pending write"""
+        with self._condition:
+            doc_id = doc["id"]
+            pending = self._pending.pop(doc_id, None)
+            if pending is not None:
+                write = self._coalesce(pending, (action, doc))
+                if write is None:
+                    # Never reached the index; nothing to send
+                    self._recent.pop(doc_id, None)
+                    self._attempts.pop(doc_id, None)
+                    return
+                action, doc = write
+            self._pending[doc_id] = (action, doc)
+            if len(self._pending) >= self.max_batch_size:
+                self._condition.notify()
+
+    @staticmethod
+    def _coalesce(older, newer):
+        """Combine two writes to the same document, or None when they cancel out"""
+        older_action, older_doc = older
+        action, doc = newer
+        if action == "delete" and older_action == "upload":
+            return None
+        if action == "merge" and older_action == "delete":
+            # A merge into a deleted document would fail; the delete still wins
+            return older
+        if action == "merge" and older_action in ("upload", "merge"):
+            return older_action, {**older_doc, **doc}
+        return action, doc
+
+    def failures_since(self, seq):
+        """Dropped writes recorded after failure number seq"""
+        with self._condition:
+            return [failure for failure in self.failures if failure["seq"] > seq]
+
+    def overlay(self, thread_id):
+        """Return (deleted_ids, docs) of writes the index may not reflect yet for a thread"""
+        now = time.monotonic()
+        deleted_ids = set()
+        docs = {}
+        with self._condition:
+            writes = [(doc_id, action, doc) for doc_id, (action, doc, until) in self._recent.items() if until > now]
+            writes += [(doc_id, action, doc) for doc_id, (action, doc) in self._pending.items()]
+        for doc_id, action, doc in writes:
+            if action == "delete":
+                deleted_ids.add(doc_id)
+                docs.pop(doc_id, None)
+            elif doc.get("thread_id", thread_id) == thread_id:
+                deleted_ids.discard(doc_id)
+                docs[doc_id] = (action, doc)
+        return deleted_ids, docs
+
+    def flush(self):
+        """Send every pending write now"""
+        with self._flush_lock:
+            with self._condition:
+                writes = list(self._pending.items())
+                self._pending.clear()
+            if writes:
+                self._send(writes)
+
+    def _send(self, writes):
+        # Map each failed document ID to (error, retryable)
+        try:
+            # Embed the content of every written document in a single request
+            if self.embed is not None:
+                to_embed = [
+                    doc for _, (action, doc) in writes
+                    if action != "delete" and doc.get("content") and self.vector_field not in doc
+                ]
+                vectors = self.embed([doc["content"] for doc in to_embed]) if to_embed else None
+                for doc, vector in zip(to_embed, vectors or []):
+                    doc[self.vector_field] = vector
+
+            batch = IndexDocumentsBatch()
+            for action in ("upload", "merge", "delete"):
+                docs = [doc for _, (doc_action, doc) in writes if doc_action == action]
+                if docs:
+                    getattr(batch, f"add_{action}_actions")(docs)
+
+            results = self.search_client.index_documents(batch)
+            errors = {
+                r.key: (r.error_message or f"status {r.status_code}", r.status_code in self.RETRYABLE_STATUS_CODES)
+                for r in results if not r.succeeded
+            }
+        except Exception as e:
+            errors = {doc_id: (str(e), True) for doc_id, _ in writes}
+
+        visible_until = time.monotonic() + self.visibility_seconds
+        with self._condition:
+            self.flushes += 1
+            now = time.monotonic()
+            self._recent = {k: v for k, v in self._recent.items() if v[2] > now}
+            for doc_id, (action, doc) in writes:
+                if doc_id not in errors:
+                    self._attempts.pop(doc_id, None)
+                    self.documents_flushed += 1
+                    self._recent[doc_id] = (action, doc, visible_until)
+                    continue
+
+                error, retryable = errors[doc_id]
+                self.last_error = f"{action} {doc_id}: {error}"
+                attempts = self._attempts.get(doc_id, 0) + 1
+                if retryable and attempts < self.max_attempts:
+                    # Send it again with the next batch, ahead of any newer write for it
+                    self._attempts[doc_id] = attempts
+                    self.documents_retried += 1
+                    newer = self._pending.pop(doc_id, None)
+                    write = (action, doc) if newer is None else self._coalesce((action, doc), newer)
+                    if write is not None:
+                        self._pending[doc_id] = write
+                else:
+                    # Give up; the document never reached the index as written
+                    self._attempts.pop(doc_id, None)
+                    self.documents_failed += 1
+                    self._recent.pop(doc_id, None)
+                    self.failures.append({
+                        "seq": next(self._failure_seq),
+                        "id": doc_id,
+                        "action": action,
+                        "thread_id": doc.get("thread_id"),
+                        "error": error,
+                        "attempts": attempts,
+                    })
+
+    def close(self):
+        """Stop the background thread and flush whatever is still queued"""
+        with self._condition:
+            if self._closed:
+                return
+            self._closed = True
+            self._condition.notify()
+        self._thread.join()
+        # Retries are bounded by max_attempts, so this ends
+        while self._pending:
+            self.flush()
+
+    def _run(self):
+        while True:
+            with self._condition:
+                self._condition.wait_for(
+                    lambda: self._closed or len(self._pending) >= self.max_batch_size,
+                    timeout=self.flush_seconds,
+                )
+                if self._closed:
+                    return
+            self.flush()
+
+@st.cache_resource
+def get_memory_write_queue():
+    """Process-wide write-behind queue for the memory index"""
+    config = get_config()
+    search_client, _ = initialize_clients()
+    return MemoryWriteQueue(
+        search_client,
+        max_batch_size=config["WRITE_BATCH_SIZE"],
+        flush_seconds=config["WRITE_FLUSH_SECONDS"],
+        embed=embed_texts if get_embedding_client() is not None else None,
+        vector_field=config["MEMORY_VECTOR_FIELD"],
+    )
+
+def report_write_failures():
+    """Log memory writes the write queue gave up on since the last report"""
+    if get_config()["MEMORY_BACKEND"] == "local":
+        return
+    for failure in get_memory_write_queue().failures_since(st.session_state.write_failure_seq):
+        st.session_state.write_failure_seq = failure["seq"]
+        if failure["thread_id"] in (None, st.session_state.thread_id):
+            add_log(
+                f"❌ Memory {failure['action']} of {failure['id']} failed after "
+                f"{failure['attempts']} attempt(s): {failure['error']}",
+                "error"
+            )
+
+def apply_pending_writes(thread_id, memories, query="", min_confidence=0.0, include_new=True):
+    """Overlay queued (not yet searchable) writes for a thread onto search results"""
+    deleted_ids, queued_docs = get_memory_write_queue().overlay(thread_id)
+    memories = [m for m in memories if m.get("id") not in deleted_ids]
+
+    found_ids = set()
+    for memory in memories:
+        queued = queued_docs.get(memory.get("id"))
+        if queued is not None:
+            memory.update({k: v for k, v in queued[1].items() if k in memory})
+        found_ids.add(memory.get("id"))
+
+    # Newly stored facts the index has not picked up yet come first
+    terms = query.lower().split()
+    new_memories = [
+        {
+            **{k: doc.get(k) for k in ("id", "content", "fact_type", "confidence")},
+            "timestamp": doc["timestamp"].isoformat() if isinstance(doc.get("timestamp"), datetime) else doc.get("timestamp"),
+        }
+        for doc_id, (action, doc) in reversed(queued_docs.items())
+        if action == "upload"
+        and doc_id not in found_ids
+        and doc.get("confidence", 1.0) >= min_confidence
+        and (not terms or any(term in doc.get("content", "").lower() for term in terms))
+    ]
+    return (new_memories if include_new else []) + memories
+
+# Pluggable memory storage behind the memory tool functions
+class MemoryBackend:
+    """
+    Storage interface used by the memory tool functions. Documents are dicts with
+    id, thread_id, content, fact_type, confidence and timestamp fields.
+    """
+
+    # True when writes are queued and only reach storage after the call returns
+    deferred_writes = False
+
+    def ensure_ready(self):
+        """Create or verify the underlying storage; returns True when usable"""
+        return True
+
+    def store(self, doc):
+        raise NotImplementedError
+
+    def merge(self, doc):
+        """Apply only the fields present in doc to an existing fact"""
+        raise NotImplementedError
+
+    def delete(self, memory_id):
+        raise NotImplementedError
+
+    def search(self, thread_id, query="", limit=3, min_confidence=0.0):
+        """Facts relevant to query, or the most recent facts when query is empty"""
+        raise NotImplementedError
+
+    def list_page(self, thread_id, continuation_token=None):
+        """One page of a thread's facts, newest first, as (facts, next_continuation_token)"""
+        raise NotImplementedError
+
+    def iter_facts(self, thread_id):
+        """Yield a thread's facts newest first, fetching one page at a time"""
+        continuation_token = None
+        while True:
+            facts, continuation_token = self.list_page(thread_id, continuation_token)
+            yield from facts
+            if not continuation_token:
+                return
+
+    def list(self, thread_id, limit=100):
+        """Most recent facts for a thread, newest first"""
+        return list(itertools.islice(self.iter_facts(thread_id), limit))
+
+class AzureSearchMemoryBackend(MemoryBackend):
+    """Facts kept in the Azure AI Search memory index, written through MemoryWriteQueue"""
+
+    deferred_writes = True
+
+    def __init__(self, search_client, write_queue, vector_field):
+        self.search_client = search_client
+        self.write_queue = write_queue
+        self.vector_field = vector_field
+
+    def ensure_ready(self):
+        return ensure_memory_index_exists()
+
+    def store(self, doc):
+        self.write_queue.enqueue("upload", doc)
+
+    def merge(self, doc):
+        # Azure AI Search has no per-document ETags; merges of the same fact are
+        # coalesced in order by the write queue. A merge of a missing fact fails
+        # when the batch is flushed and shows up in the session's memory operations
+        self.write_queue.enqueue("merge", doc)
+
+    def delete(self, memory_id):
+        self.write_queue.enqueue("delete", {"id": memory_id})
+
+    def search(self, thread_id, query="", limit=3, min_confidence=0.0):
+        filter_expr = f"thread_id eq '{thread_id}' and confidence ge {min_confidence}"
+
+        if query:
+            # Hybrid (keyword + vector) search when embeddings are available
+            vector_queries = None
+            query_vectors = embed_texts([query])
+            if query_vectors:
+                vector_queries = [
+                    VectorizedQuery(
+                        vector=query_vectors[0],
+                        k_nearest_neighbors=max(limit, 10),
+                        fields=self.vector_field,
+                    )
+                ]
+
+            # Semantic search with filter
+            results = self.search_client.search(
+                search_text=query,
+                vector_queries=vector_queries,
+                filter=filter_expr,
+                top=limit,
+                select="id,content,fact_type,confidence,timestamp",
+            )
+        else:
+            # Get most recent facts
+            results = self.search_client.search(
+                search_text="*",
+                filter=filter_expr,
+                top=limit,
+                order_by="timestamp desc",
+                select="id,content,fact_type,confidence,timestamp",
+            )
+
+        memories = []
+        for r in results:
+            memories.append(
+                {
+                    "id": r.get("id", ""),
+                    "content": r.get("content", ""),
+                    "fact_type": r.get("fact_type", "other"),
+                    "confidence": r.get("confidence", 1.0),
+                }
+            )
+
+        # Include writes that are still queued or not yet searchable
+        return apply_pending_writes(thread_id, memories, query, min_confidence)[:limit]
+
+    def list_page(self, thread_id, continuation_token=None):
+        # Without top the service returns results in pages (50 documents by default)
+        # and the SDK exposes the position of the next page as a continuation token
+        results = self.search_client.search(
+            search_text="*",
+            filter=f"thread_id eq '{thread_id}'",
+            order_by="timestamp desc",
+            select="id,content,fact_type,confidence,timestamp",
+        )
+        pages = results.by_page(continuation_token=continuation_token)
+        facts = [dict(r) for r in next(pages, [])]
+        # Facts stored but not yet searchable belong at the top of the first page
+        facts = apply_pending_writes(thread_id, facts, include_new=continuation_token is None)
+        return facts, pages.continuation_token
+
+class LocalMemoryBackend(MemoryBackend):
+    """
+    In-process memory store for single-node deployments and tests. Embeddings live in
+    a memory-mapped float32 matrix under path. Fact metadata is a JSON snapshot plus
+    an append-only log of the writes made since; the log is folded into the snapshot
+    once it holds more records than there are facts, so a write costs O(1) amortized.
+    Queries are a brute-force scan (no ANN index) of a thread's facts: they rank them
+    by keyword overlap and exact cosine similarity with NumPy and fuse the two
+    rankings (reciprocal rank fusion, as Azure AI Search does for hybrid queries).
+    Without an embedding function, a hashed bag-of-words embedding is used so the
+    store works fully offline.
+    """
+
+    RRF_K = 60
+    PAGE_SIZE = 50
+    COMPACT_MIN_RECORDS = 100
+
+    def __init__(self, path, dimensions, embed=None):
+        self.path = path
+        self.dimensions = dimensions
+        self.embed = embed
+        self._facts_path = os.path.join(path, "facts.json")
+        self._log_path = os.path.join(path, "facts.log")
+        self._vectors_path = os.path.join(path, "vectors.f32")
+        self._log_records = 0
+        self._persisted_capacity = None
+        self._lock = threading.Lock()
+        self._facts = {}  # id -> doc
+        self._rows = {}  # id -> row in the vector matrix
+        self._free_rows = []
+        self._capacity = 0
+        self._vectors = None
+        os.makedirs(path, exist_ok=True)
+        self._load()
+
+    def _open_vectors(self, capacity):
+        # numpy extends the file when it is smaller than the requested shape
+        mode = "r+" if os.path.exists(self._vectors_path) else "w+"
+        self._vectors = np.memmap(
+            self._vectors_path, dtype=np.float32, mode=mode, shape=(capacity, self.dimensions)
+        )
+        self._capacity = capacity
+
+    def _load(self):
+        meta = {}
+        facts = {}
+        if os.path.exists(self._facts_path):
+            with open(self._facts_path, "r", encoding="utf-8") as f:
+                meta = json.load(f)
+            facts = {doc["id"]: doc for doc in meta.get("facts", [])}
+        # Replay the writes made after the snapshot
+        torn = False
+        if os.path.exists(self._log_path):
+            with open(self._log_path, "r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        torn = True  # a write cut short by a crash
+                        break
+                    if record["op"] == "delete":
+                        facts.pop(record["id"], None)
+                    else:
+                        facts[record["doc"]["id"]] = record["doc"]
+                    self._log_records += 1
+        facts = list(facts.values())
+
+        if meta:
+            if meta.get("dimensions") == self.dimensions and os.path.exists(self._vectors_path):
+                self._open_vectors(meta["capacity"])
+                self._persisted_capacity = self._capacity
+                for doc in facts:
+                    self._rows[doc["id"]] = doc.pop("row")
+                    self._facts[doc["id"]] = doc
+                used = set(self._rows.values())
+                self._free_rows = [row for row in range(self._capacity - 1, -1, -1) if row not in used]
+                if torn:
+                    # Start a clean log rather than append after the partial record
+                    self._compact()
+                return
+            # Embedding size changed; rebuild the vector file from the stored facts
+            if os.path.exists(self._vectors_path):
+                os.remove(self._vectors_path)
+
+        self._open_vectors(max(64, 2 * len(facts)))
+        self._free_rows = list(range(self._capacity - 1, -1, -1))
+        for doc in facts:
+            doc.pop("row", None)
+        vectors = self._embed([doc["content"] for doc in facts])
+        for doc, vector in zip(facts, vectors):
+            self._put(doc, vector)
+        self._compact()
+
+    def _hash_embed(self, text):
+        vector = np.zeros(self.dimensions, dtype=np.float32)
+        for token in re.findall(r"\w+", text.lower()):
+            vector[zlib.crc32(token.encode("utf-8")) % self.dimensions] += 1.0
+        return vector
+
+    def _embed(self, texts):
+        if not texts:
+            return np.zeros((0, self.dimensions), dtype=np.float32)
+        if self.embed is None:
+            vectors = np.stack([self._hash_embed(text) for text in texts])
+        else:
+            # Fall back to keyword-only ranking for these facts if embedding fails
+            embedded = self.embed(texts)
+            if embedded is None:
+                vectors = np.zeros((len(texts), self.dimensions), dtype=np.float32)
+            else:
+                vectors = np.asarray(embedded, dtype=np.float32)
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        return vectors / np.where(norms == 0, 1.0, norms)
+
+    def _put(self, doc, vector):
+        row = self._rows.get(doc["id"])
+        if row is None:
+            if not self._free_rows:
+                self._vectors.flush()
+                old_capacity = self._capacity
+                self._open_vectors(old_capacity * 2)
+                self._free_rows = list(range(self._capacity - 1, old_capacity - 1, -1))
+            row = self._free_rows.pop()
+            self._rows[doc["id"]] = row
+        self._vectors[row] = vector
+        self._facts[doc["id"]] = doc
+
+    def _persist(self, record):
+        """Append one write to the log, or compact when the log or the matrix has outgrown the snapshot"""
+        self._vectors.flush()
+        self._log_records += 1
+        if (self._capacity != self._persisted_capacity
+                or self._log_records > max(self.COMPACT_MIN_RECORDS, len(self._facts))):
+            self._compact()
+            return
+        with open(self._log_path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(record) + "\n")
+
+    def _compact(self):
+        """Write every fact to a new snapshot and start an empty log"""
+        self._vectors.flush()
+        meta = {
+            "dimensions": self.dimensions,
+            "capacity": self._capacity,
+            "facts": [{**doc, "row": self._rows[doc_id]} for doc_id, doc in self._facts.items()],
+        }
+        tmp_path = f"{self._facts_path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(meta, f)
+        os.replace(tmp_path, self._facts_path)
+        # Replaying records already in the snapshot is harmless if this is interrupted
+        if os.path.exists(self._log_path):
+            os.remove(self._log_path)
+        self._log_records = 0
+        self._persisted_capacity = self._capacity
+
+    def _put_record(self, doc_id):
+        return {"op": "put", "doc": {**self._facts[doc_id], "row": self._rows[doc_id]}}
+
+    @staticmethod
+    def _normalize(doc):
+        timestamp = doc.get("timestamp")
+        if isinstance(timestamp, datetime):
+            doc = {**doc, "timestamp": timestamp.isoformat()}
+        return doc
+
+    @staticmethod
+    def _public(doc, with_timestamp=False):
+        keys = ("id", "content", "fact_type", "confidence") + (("timestamp",) if with_timestamp else ())
+        return {k: doc.get(k) for k in keys}
+
+    def store(self, doc):
+        doc = self._normalize(doc)
+        vector = self._embed([doc["content"]])[0]
+        with self._lock:
+            self._put(doc, vector)
+            self._persist(self._put_record(doc["id"]))
+
+    def merge(self, doc):
+        doc = self._normalize(doc)
+        # Embed outside the lock, then apply the changed fields to the current version
+        vector = self._embed([doc["content"]])[0] if "content" in doc else None
+        with self._lock:
+            existing = self._facts.get(doc["id"])
+            if existing is None:
+                raise KeyError(doc["id"])
+            merged = {**existing, **doc}
+            if vector is None:
+                self._facts[merged["id"]] = merged
+            else:
+                self._put(merged, vector)
+            self._persist(self._put_record(merged["id"]))
+
+    def delete(self, memory_id):
+        with self._lock:
+            if self._facts.pop(memory_id, None) is None:
+                return
+            self._free_rows.append(self._rows.pop(memory_id))
+            self._persist({"op": "delete", "id": memory_id})
+
+    def search(self, thread_id, query="", limit=3, min_confidence=0.0):
+        query_vector = self._embed([query])[0] if query else None
+        with self._lock:
+            candidates = [
+                doc for doc in self._facts.values()
+                if doc.get("thread_id") == thread_id and doc.get("confidence", 1.0) >= min_confidence
+            ]
+            if not candidates:
+                return []
+            if query_vector is None:
+                candidates.sort(key=lambda doc: doc.get("timestamp", ""), reverse=True)
+                return [self._public(doc) for doc in candidates[:limit]]
+            vector_scores = self._vectors[[self._rows[doc["id"]] for doc in candidates]] @ query_vector
+
+        terms = set(re.findall(r"\w+", query.lower()))
+        keyword_scores = np.array(
+            [len(terms & set(re.findall(r"\w+", doc["content"].lower()))) for doc in candidates]
+        )
+        fused = np.zeros(len(candidates))
+        for rank, i in enumerate(np.argsort(-vector_scores, kind="stable")):
+            fused[i] += 1.0 / (self.RRF_K + rank + 1)
+        for rank, i in enumerate(np.argsort(-keyword_scores, kind="stable")):
+            if keyword_scores[i] > 0:
+                fused[i] += 1.0 / (self.RRF_K + rank + 1)
+        return [self._public(candidates[i]) for i in np.argsort(-fused, kind="stable")[:limit]]
+
+    def list_page(self, thread_id, continuation_token=None):
+        # The continuation token is the offset of the next page
+        start = int(continuation_token or 0)
+        with self._lock:
+            facts = [doc for doc in self._facts.values() if doc.get("thread_id") == thread_id]
+        facts.sort(key=lambda doc: doc.get("timestamp", ""), reverse=True)
+        end = start + self.PAGE_SIZE
+        next_token = str(end) if end < len(facts) else None
+        return [self._public(doc, with_timestamp=True) for doc in facts[start:end]], next_token
+
+@st.cache_resource
+def get_memory_backend():
+    """Process-wide memory backend selected by MEMORY_BACKEND ("azure" or "local")"""
+    config = get_config()
+    if config["MEMORY_BACKEND"] == "local":
+        embed = embed_texts if get_embedding_client() is not None else None
+        return LocalMemoryBackend(
+            config["MEMORY_LOCAL_PATH"],
+            config["EMBEDDING_DIMENSIONS"] if embed else config["MEMORY_LOCAL_DIMENSIONS"],
+            embed=embed,
+        )
+    search_client, _ = initialize_clients()
+    return AzureSearchMemoryBackend(
+        search_client, get_memory_write_queue(), config["MEMORY_VECTOR_FIELD"]
+    )
+
+# Session-local cache of the current thread's facts
+class SessionFactCache:
+    """
+    Facts for one conversation thread, prefetched once and kept coherent by the
+    memory tool functions so retrievals usually skip the backend. The cache only
+    answers while it holds every fact of the thread (at most max_facts); with
+    semantic retrieval enabled, queries it cannot fully answer by keyword go to the
+    backend.
+    """
+
+    FIELDS = ("id", "content", "fact_type", "confidence", "timestamp")
+
+    def __init__(self, thread_id, max_facts=200, semantic=False):
+        self.thread_id = thread_id
+        self.max_facts = max_facts
+        self.semantic = semantic
+        self.complete = False
+        self.hits = 0
+        self.misses = 0
+        self._facts = {}
+        self._lock = threading.Lock()  # tool calls run on worker threads
+
+    def prefetch(self, backend):
+        """Load the thread's facts from the backend"""
+        facts = backend.list(self.thread_id, limit=self.max_facts + 1)
+        with self._lock:
+            self._facts = {}
+            for fact in facts[: self.max_facts]:
+                self._put(fact)
+            self.complete = len(facts) <= self.max_facts
+
+    def get(self, memory_id):
+        with self._lock:
+            fact = self._facts.get(memory_id)
+            return dict(fact) if fact is not None else None
+
+    def put(self, doc):
+        """Record a stored or (partially) updated fact"""
+        with self._lock:
+            self._put(doc)
+
+    def _put(self, doc):
+        if doc["id"] not in self._facts and "fact_type" not in doc:
+            return  # partial update of a fact this cache never held
+        entry = {**self._facts.get(doc["id"], {}), **{k: doc[k] for k in self.FIELDS if k in doc}}
+        if isinstance(entry.get("timestamp"), datetime):
+            entry["timestamp"] = entry["timestamp"].isoformat()
+        if doc["id"] not in self._facts and len(self._facts) >= self.max_facts:
+            self.complete = False
+            return
+        self._facts[doc["id"]] = entry
+
+    def remove(self, memory_id):
+        with self._lock:
+            self._facts.pop(memory_id, None)
+
+    def search(self, query="", limit=3, min_confidence=0.0):
+        """Facts for a retrieval, or None when the backend has to answer it"""
+        with self._lock:
+            if not self.complete:
+                self.misses += 1
+                return None
+            facts = list(self._facts.values())
+
+        candidates = [f for f in facts if f.get("confidence", 1.0) >= min_confidence]
+        candidates.sort(key=lambda f: f.get("timestamp") or "", reverse=True)
+        if query and len(candidates) > limit:
+            terms = set(re.findall(r"\w+", query.lower()))
+            scored = [(len(terms & set(re.findall(r"\w+", f["content"].lower()))), f) for f in candidates]
+            # Stable sort keeps the most recent first among equal scores
+            matched = [f for score, f in sorted(scored, key=lambda x: -x[0]) if score > 0]
+            if self.semantic and len(matched) < limit:
+                with self._lock:
+                    self.misses += 1
+                return None
+            candidates = matched
+
+        with self._lock:
+            self.hits += 1
+        return [{k: f.get(k) for k in ("id", "content", "fact_type", "confidence")} for f in candidates[:limit]]
+
+def get_fact_cache(thread_id):
+    """The session's fact cache if it belongs to thread_id"""
+    cache = st.session_state.get("fact_cache")
+    if cache is not None and cache.thread_id == thread_id:
+        return cache
+    return None
+
 # Define memory management functions for agent
 def create_memory_functions():
     """Define memory management functions"""
-    search_client, _ = initialize_clients()
+    backend = get_memory_backend()
 
     # CREATE memory function
     def store_memory_func(thread_id, content, fact_type="other", confidence=1.0):
@@ -291,7 +1265,10 @@ def create_memory_functions():
                 "timestamp": datetime.now(UTC),
             }
 
-            result = search_client.upload_documents([doc])
+            backend.store(doc)
+            cache = get_fact_cache(thread_id)
+            if cache is not None:
+                cache.put(doc)
 
             if st.session_state.debug_mode:
                 add_log(
@@ -329,41 +1306,20 @@ def create_memory_functions():
                     )
                 thread_id = st.session_state.thread_id
 
-            filter_expr = f"thread_id eq '{thread_id}' and confidence ge {min_confidence}"
+            # Serve from the session cache when it holds the whole thread
+            cache = get_fact_cache(thread_id)
+            memories = cache.search(query, limit, min_confidence) if cache is not None else None
+            if memories is None:
+                memories = backend.search(thread_id, query, limit, min_confidence)
+            elif st.session_state.debug_mode:
+                add_log(f"⚡ Served from session fact cache", "debug")
 
-            if query:
-                # Semantic search with filter
-                results = search_client.search(
-                    search_text=query,
-                    filter=filter_expr,
-                    top=limit,
-                    select="id,content,fact_type,confidence,timestamp",
-                )
-                if st.session_state.debug_mode:
+            if st.session_state.debug_mode:
+                if query:
                     add_log(f"🔍 Retrieving memories for query: '{query}'", "memory")
-            else:
-                # Get most recent facts
-                results = search_client.search(
-                    search_text="*",
-                    filter=filter_expr,
-                    top=limit,
-                    order_by="timestamp desc",
-                    select="id,content,fact_type,confidence,timestamp",
-                )
-                if st.session_state.debug_mode:
+                else:
                     add_log(f"🔍 Retrieving {limit} most recent memories", "memory")
 
-            memories = []
-            for r in results:
-                memories.append(
-                    {
-                        "id": r.get("id", ""),
-                        "content": r.get("content", ""),
-                        "fact_type": r.get("fact_type", "other"),
-                        "confidence": r.get("confidence", 1.0),
-                    }
-                )
-
             if st.session_state.debug_mode and memories:
                 add_log(f"🔍 Retrieved {len(memories)} memories", "memory")
 
@@ -399,26 +1355,36 @@ def create_memory_functions():
                     )
                 thread_id = st.session_state.thread_id
 
-            # First retrieve the existing document
-            try:
-                existing_doc = search_client.get_document(key=memory_id)
-            except Exception as e:
+            # The session cache knows every fact of the thread, so a missing ID can
+            # be rejected without a round trip
+            cache = get_fact_cache(thread_id)
+            if cache is not None and cache.complete and cache.get(memory_id) is None:
                 if st.session_state.debug_mode:
-                    add_log(f"❌ ERROR retrieving document for update: {e}", "error")
+                    add_log(f"❌ ERROR updating memory: {memory_id} is not in this thread", "error")
                 return json.dumps({"error": f"Document with ID {memory_id} not found"})
 
-            # Prepare the updated document
+            # Send only the changed fields; the stored fact_type and confidence are
+            # kept unless new values are given
             doc = {
                 "id": memory_id,
                 "thread_id": thread_id,
                 "content": new_content,
-                "fact_type": fact_type or existing_doc.get("fact_type", "other"),
-                "confidence": confidence or existing_doc.get("confidence", 1.0),
                 "timestamp": datetime.now(UTC),
             }
+            if fact_type:
+                doc["fact_type"] = fact_type
+            if confidence is not None:
+                doc["confidence"] = confidence
 
-            # Update the document
-            result = search_client.merge_documents([doc])
+            # Update the document in a single merge
+            try:
+                backend.merge(doc)
+            except KeyError:
+                if st.session_state.debug_mode:
+                    add_log(f"❌ ERROR updating memory: {memory_id} not found", "error")
+                return json.dumps({"error": f"Document with ID {memory_id} not found"})
+            if cache is not None:
+                cache.put(doc)
 
             if st.session_state.debug_mode:
                 add_log(
@@ -428,6 +1394,9 @@ def create_memory_functions():
                     "memory"
                 )
 
+            # Without a complete cache a queued merge cannot be confirmed yet
+            if backend.deferred_writes and not (cache is not None and cache.complete):
+                return json.dumps({"id": memory_id, "status": "queued"})
             return json.dumps({"id": memory_id, "status": "updated"})
         except Exception as e:
             if st.session_state.debug_mode:
@@ -443,7 +1412,10 @@ def create_memory_functions():
                 add_log(f"  - Memory ID: {memory_id}", "debug")
 
             # Delete the document
-            search_client.delete_documents([{"id": memory_id}])
+            backend.delete(memory_id)
+            cache = get_fact_cache(st.session_state.thread_id)
+            if cache is not None:
+                cache.remove(memory_id)
 
             if st.session_state.debug_mode:
                 add_log(f"🗑️ DELETED: [fact] {memory_id}", "memory")
@@ -478,33 +1450,61 @@ def log_memory_operation(operation, details=None, additional_data=None):
     else:
         add_log(f"📊 MEMORY OPERATION [{operation}]: {details}", "memory_highlight")
 
-# Process function calls from the agent
-def process_function_calls(thread_id, run_id, tool_calls):
-    """Process function calls from the agent and submit tool outputs"""
+# Build the memory tool registry once per process
+@st.cache_resource
+def get_memory_tool_registry():
+    """Build the memory functions, their FunctionTool schemas and a name → callable dispatch table"""
+    memory_functions = create_memory_functions()
+    function_tool = FunctionTool(memory_functions)
+    return {
+        "definitions": function_tool.definitions,
+        "functions": {func.__name__: func for func in memory_functions},
+    }
+
+# Execute function calls from the agent
+@st.cache_resource
+def get_tool_call_executor():
+    """Bounded thread pool shared by all sessions for memory tool calls"""
+    return ThreadPoolExecutor(
+        max_workers=get_config()["TOOL_CALL_WORKERS"], thread_name_prefix="memory-tool"
+    )
+
+def run_tool_call_lane(ctx, calls):
+    """Run (index, function, args) calls in order on a worker thread; returns (index, output, error)"""
+    # Memory functions read session state, which needs the session's script context
+    add_script_run_ctx(threading.current_thread(), ctx)
+    results = []
+    for index, function, args in calls:
+        try:
+            results.append((index, function(**args), None))
+        except Exception as e:
+            results.append((index, None, e))
+    return results
+
+def execute_function_calls(tool_calls):
+    """Execute function calls from the agent and return their tool outputs"""
     try:
-        memory_functions = create_memory_functions()
-        function_tool = FunctionTool(memory_functions)
-        _, projects_client = initialize_clients()
+        memory_functions = get_memory_tool_registry()["functions"]
 
         tool_outputs = []
         memory_ops_summary = []
+        prepared = []
         
         for tool_call in tool_calls:
             if isinstance(tool_call, RequiredFunctionToolCall):
                 try:
                     function_name = tool_call.function.name
                     arguments = tool_call.function.arguments
+                    args = json.loads(arguments) if arguments else {}
                     
                     # Always show when memory functions are called (regardless of debug_mode)
                     if function_name == "store_memory_func":
-                        args = json.loads(arguments)
                         content = args.get("content", "")
                         fact_type = args.get("fact_type", "other")
                         log_memory_operation("store", f"[{fact_type}] {content[:100]}" + ("..." if len(content) > 100 else ""))
                         memory_ops_summary.append("stored new fact")
                     
                     elif function_name == "retrieve_memories_func":
-                        args = json.loads(arguments)
                         query = args.get("query", "")
                         if query:
                             log_memory_operation("retrieve", f"Query: '{query}'")
@@ -513,14 +1513,12 @@ def process_function_calls(thread_id, run_id, tool_calls):
                         memory_ops_summary.append("retrieved facts")
                     
                     elif function_name == "update_memory_func":
-                        args = json.loads(arguments)
                         memory_id = args.get("memory_id", "")
                         new_content = args.get("new_content", "")
                         log_memory_operation("update", f"ID {memory_id[:8]}... - {new_content[:100]}" + ("..." if len(new_content) > 100 else ""))
                         memory_ops_summary.append("updated fact")
                     
                     elif function_name == "delete_memory_func":
-                        args = json.loads(arguments)
                         memory_id = args.get("memory_id", "")
                         log_memory_operation("delete", memory_id)
                         memory_ops_summary.append("deleted fact")
@@ -529,74 +1527,202 @@ def process_function_calls(thread_id, run_id, tool_calls):
                         add_log(f"🛠️ Processing tool call: {function_name}", "debug")
                         add_log(f"  - Arguments: {arguments}", "debug")
 
-                    # Execute the function
-                    output = function_tool.execute(tool_call)
-                    
-                    # For retrieve_memories_func, show how many memories were retrieved
-                    if function_name == "retrieve_memories_func":
-                        try:
-                            result = json.loads(output)
-                            args = json.loads(arguments)
-                            query = args.get("query", "")
-                            
-                            if "memories" in result and "count" in result:
-                                memories = result["memories"]
-                                count = result["count"]
-                                
-                                # Create a structured representation of retrieved memories
-                                retrieved_memories = {
-                                    "query": query if query else "recent facts",
-                                    "count": count,
-                                    "memories": memories
-                                }
-                                
-                                # Log the retrieval operation with the full memory data
-                                if query:
-                                    log_message = f"{count} fact(s) returned for query: '{query}'"
-                                else:
-                                    log_message = f"{count} recent fact(s) returned"
-                                    
-                                log_memory_operation("retrieve", log_message, retrieved_memories)
-                                
-                                # Also log individual memories for debug view
-                                if count > 0:
-                                    for i, memory in enumerate(memories):
-                                        add_log(f"  {i+1}. [{memory.get('fact_type', 'other')}] {memory.get('content', '')}", "fact")
-                        except Exception as e:
-                            add_log(f"Error processing retrieved memories: {e}", "error")
-
-                    tool_outputs.append(
-                        ToolOutput(tool_call_id=tool_call.id, output=output)
-                    )
+                    prepared.append((tool_call, function_name, args))
                 except Exception as e:
                     add_log(f"❌ Error executing tool call {tool_call.id}: {e}", "error")
 
-        if tool_outputs:
-            if st.session_state.debug_mode:
-                add_log(f"📤 Submitting {len(tool_outputs)} tool outputs", "debug")
+        # Independent calls run concurrently; calls on the same memory ID share a
+        # lane so their writes stay in the order the agent issued them
+        lanes = {}
+        outputs = {}
+        for index, (tool_call, function_name, args) in enumerate(prepared):
+            function = memory_functions.get(function_name)
+            if function is None:
+                outputs[index] = (json.dumps({"error": f"Unknown function: {function_name}"}), None)
+                continue
+            lane_key = args.get("memory_id") or f"call-{index}"
+            lanes.setdefault(lane_key, []).append((index, function, args))
+
+        ctx = get_script_run_ctx()
+        if len(lanes) == 1:
+            lane_results = [run_tool_call_lane(ctx, calls) for calls in lanes.values()]
+        else:
+            executor = get_tool_call_executor()
+            futures = [executor.submit(run_tool_call_lane, ctx, calls) for calls in lanes.values()]
+            lane_results = [future.result() for future in futures]
+        for results in lane_results:
+            for index, output, error in results:
+                outputs[index] = (output, error)
+
+        # Collect outputs in the original order
+        for index, (tool_call, function_name, args) in enumerate(prepared):
+            output, error = outputs[index]
+            if error is not None:
+                add_log(f"❌ Error executing tool call {tool_call.id}: {error}", "error")
+                continue
+            try:
+                # For retrieve_memories_func, show how many memories were retrieved
+                if function_name == "retrieve_memories_func":
+                    try:
+                        result = json.loads(output)
+                        query = args.get("query", "")
+                        
+                        if "memories" in result and "count" in result:
+                            memories = result["memories"]
+                            count = result["count"]
+                            
+                            # Create a structured representation of retrieved memories
+                            retrieved_memories = {
+                                "query": query if query else "recent facts",
+                                "count": count,
+                                "memories": memories
+                            }
+                            
+                            # Log the retrieval operation with the full memory data
+                            if query:
+                                log_message = f"{count} fact(s) returned for query: '{query}'"
+                            else:
+                                log_message = f"{count} recent fact(s) returned"
+                                
+                            log_memory_operation("retrieve", log_message, retrieved_memories)
+                            
+                            # Also log individual memories for debug view
+                            if count > 0:
+                                for i, memory in enumerate(memories):
+                                    add_log(f"  {i+1}. [{memory.get('fact_type', 'other')}] {memory.get('content', '')}", "fact")
+                    except Exception as e:
+                        add_log(f"Error processing retrieved memories: {e}", "error")
+
+                tool_outputs.append(
+                    ToolOutput(tool_call_id=tool_call.id, output=output)
+                )
+            except Exception as e:
+                add_log(f"❌ Error executing tool call {tool_call.id}: {e}", "error")
 
-            projects_client.agents.submit_tool_outputs_to_run(
-                thread_id=thread_id, run_id=run_id, tool_outputs=tool_outputs
-            )
-            
-            if memory_ops_summary:
-                add_log(f"📊 MEMORY OPERATIONS SUMMARY: {', '.join(memory_ops_summary)}", "summary")
+        if tool_outputs and memory_ops_summary:
+            add_log(f"📊 MEMORY OPERATIONS SUMMARY: {', '.join(memory_ops_summary)}", "summary")
 
-        return len(tool_outputs)
+        return tool_outputs
     except Exception as e:
         add_log(f"❌ Error processing function calls: {e}", "error")
+        return []
+
+# Process function calls from the agent (polling path)
+def process_function_calls(thread_id, run_id, tool_calls, known_outputs=None):
+    """Process function calls from the agent and submit tool outputs.
+    Calls that already have an output in known_outputs (tool_call_id -> output) are not run again."""
+    known_outputs = known_outputs or {}
+    tool_outputs = [known_outputs[call.id] for call in tool_calls if call.id in known_outputs]
+    new_calls = [call for call in tool_calls if call.id not in known_outputs]
+    if new_calls:
+        tool_outputs += execute_function_calls(new_calls)
+    if not tool_outputs:
+        return 0
+
+    try:
+        _, projects_client = initialize_clients()
+        if st.session_state.debug_mode:
+            add_log(f"📤 Submitting {len(tool_outputs)} tool outputs", "debug")
+
+        projects_client.agents.submit_tool_outputs_to_run(
+            thread_id=thread_id, run_id=run_id, tool_outputs=tool_outputs
+        )
+        return len(tool_outputs)
+    except Exception as e:
+        add_log(f"❌ Error submitting tool outputs: {e}", "error")
         return 0
 
+# Handle run events as they are streamed from the agent service
+class MemoryRunEventHandler(AgentEventHandler):
+    """Answers tool calls as soon as a streamed run requires action"""
+
+    def __init__(self, projects_client):
+        super().__init__()
+        self.projects_client = projects_client
+        self.run = None
+        self.tool_outputs = {}  # tool_call_id -> output, for resuming without re-running tools
+
+    def on_thread_run(self, run):
+        self.run = run
+        add_log(f"🔄 Run status: {run.status}", "debug")
+
+        if run.status == "requires_action" and isinstance(run.required_action, SubmitToolOutputsAction):
+            tool_calls = run.required_action.submit_tool_outputs.tool_calls
+            tool_outputs = execute_function_calls(tool_calls)
+            self.tool_outputs.update((output["tool_call_id"], output) for output in tool_outputs)
+            if tool_outputs:
+                if st.session_state.debug_mode:
+                    add_log(f"📤 Submitting {len(tool_outputs)} tool outputs", "debug")
+                self.projects_client.agents.submit_tool_outputs_to_stream(
+                    thread_id=run.thread_id,
+                    run_id=run.id,
+                    tool_outputs=tool_outputs,
+                    event_handler=self,
+                )
+
+    def on_error(self, data):
+        add_log(f"❌ Run stream error: {data}", "error")
+
+# Run the agent on a thread, streaming run events
+def run_with_streaming(projects_client, thread_id, agent_id, handler):
+    """Create a run and handle its events as they arrive; returns the last run state"""
+    with projects_client.agents.create_stream(
+        thread_id=thread_id, assistant_id=agent_id, event_handler=handler
+    ) as stream:
+        stream.until_done()
+    return handler.run
+
+# Run the agent on a thread, polling with exponential backoff
+def run_with_polling(projects_client, thread_id, agent_id, run=None, known_outputs=None):
+    """Create a run (or resume an existing one) and poll it until it finishes.
+    Tool calls with an output in known_outputs are answered with it instead of being run again."""
+    config = get_config()
+    if run is None:
+        run = projects_client.agents.create_run(thread_id=thread_id, assistant_id=agent_id)
+
+    # Poll at the minimum interval right after submitting tool outputs and back off
+    # while the run is queued or working
+    delay = config["RUN_POLL_MIN_SECONDS"]
+    while run.status in ["queued", "in_progress", "requires_action"]:
+        time.sleep(delay)
+        run = projects_client.agents.get_run(thread_id=thread_id, run_id=run.id)
+
+        add_log(f"🔄 Run status: {run.status}", "debug")
+
+        if run.status == "requires_action" and isinstance(run.required_action, SubmitToolOutputsAction):
+            tool_calls = run.required_action.submit_tool_outputs.tool_calls
+            if tool_calls:
+                process_function_calls(thread_id, run.id, tool_calls, known_outputs)
+            delay = config["RUN_POLL_MIN_SECONDS"]
+        else:
+            delay = min(delay * config["RUN_POLL_BACKOFF"], config["RUN_POLL_MAX_SECONDS"])
+
+    return run
+
+# Fetch only the newest assistant message instead of listing the whole thread
+def get_latest_assistant_message(projects_client, thread_id, run_id=None):
+    """Newest assistant message (of run_id, if given) not returned before, or None"""
+    messages = projects_client.agents.list_messages(
+        thread_id=thread_id, run_id=run_id, order=ListSortOrder.DESCENDING, limit=1
+    )
+    latest = messages.data[0] if messages.data else None
+    if latest is None or latest.role != "assistant":
+        return None
+
+    # Remember the last message shown per thread so a run without a new reply
+    # does not repeat the previous answer
+    if st.session_state.last_message_ids.get(thread_id) == latest.id:
+        return None
+    st.session_state.last_message_ids[thread_id] = latest.id
+    return latest
+
 # Create memory agent with function calling
 def create_memory_agent():
     """Create agent with memory management functions"""
     _, projects_client = initialize_clients()
 
-    # Initialize the memory functions
-    memory_functions = create_memory_functions()
-
-    # Create a function tool with the memory functions
-    function_tool = FunctionTool(memory_functions)
+    # Memory function definitions are built once per process
+    memory_tool_definitions = get_memory_tool_registry()["definitions"]
 
     # Create agent with complete memory management instructions
     agent = projects_client.agents.create_agent(
@@ -630,7 +1756,7 @@ Examples of facts to store:
 
 Be proactive in memory management - don't wait for explicit instructions to store facts.
 NEVER mention the memory system to users - just naturally incorporate what you know.""",
-        tools=function_tool.definitions,
+        tools=memory_tool_definitions,
     )
 
     add_log(f"🤖 Memory agent created with ID: {agent.id}", "system")
@@ -639,8 +1765,8 @@ NEVER mention the memory system to users - just naturally incorporate what you k
 # Start conversation with memory agent
 def initialize_agent():
     """Initialize the memory agent and start a new conversation"""
-    # Ensure memory index exists before proceeding
-    if not ensure_memory_index_exists():
+    # Ensure memory storage exists before proceeding
+    if not get_memory_backend().ensure_ready():
         add_log("❌ Failed to create or verify memory index. Exiting.", "error")
         return False
         
@@ -652,36 +1778,41 @@ def initialize_agent():
     _, projects_client = initialize_clients()
     thread = projects_client.agents.create_thread()
     st.session_state.thread_id = thread.id
+
+    # Prefetch the thread's facts once; tool calls keep the cache coherent
+    config = get_config()
+    cache = SessionFactCache(
+        thread.id,
+        max_facts=config["FACT_CACHE_MAX_FACTS"],
+        semantic=get_embedding_client() is not None,
+    )
+    try:
+        cache.prefetch(get_memory_backend())
+    except Exception as e:
+        add_log(f"⚠️ Could not prefetch facts, using the memory backend: {e}", "warning")
+    st.session_state.fact_cache = cache
     add_log(f"🆕 Started new conversation (Thread ID: {thread.id})", "system")
     
     st.session_state.initialized = True
     st.session_state.messages = []
     return True
 
-# List all facts in memory
-def list_all_facts():
-    """List all facts stored for the current thread"""
-    search_client, _ = initialize_clients()
+# List all facts in memory, one page at a time
+def list_all_facts(continuation_token=None):
+    """Return one page of the current thread's facts and the token for the next page"""
     try:
-        # Get all facts for this thread
-        results = search_client.search(
-            search_text="*",
-            filter=f"thread_id eq '{st.session_state.thread_id}'",
-            top=100,
-            order_by="timestamp desc",
-            select="id,content,fact_type,confidence,timestamp",
+        facts, next_token = get_memory_backend().list_page(
+            st.session_state.thread_id, continuation_token
         )
 
-        facts = list(results)
-
-        if not facts:
+        if not facts and continuation_token is None:
             st.warning(f"No facts found for thread ID: {st.session_state.thread_id}")
-            return []
+            return [], None
         
-        return facts
+        return facts, next_token
     except Exception as e:
         add_log(f"❌ ERROR listing facts: {e}", "error")
-        return []
+        return [], None
 
 # Process user message and get response
 def process_message(user_input):
@@ -705,6 +1836,7 @@ def process_message(user_input):
         
     if user_input.lower() in ["facts", "list facts", "show facts"]:
         st.session_state.show_facts = True
+        st.session_state.fact_page = None
         return
         
     if user_input.lower() == "memory on":
@@ -721,7 +1853,12 @@ def process_message(user_input):
     st.session_state.run_active = True
         
     # Add user message to the UI with timestamp
-    st.session_state.messages.append({"role": "user", "content": user_input, "timestamp": current_time})
+    st.session_state.messages.append({
+        "role": "user",
+        "content": user_input,
+        "timestamp": current_time,
+        "op_seq": st.session_state.memory_ops.next_seq,
+    })
     
     try:
         # Add message to thread
@@ -732,35 +1869,31 @@ def process_message(user_input):
 
         add_log("⏳ Processing...", "system")
 
-        # Create a run
-        run = projects_client.agents.create_run(
-            thread_id=st.session_state.thread_id, assistant_id=st.session_state.agent_id
-        )
-
-        # Process the run and handle any function calls
-        while run.status in ["queued", "in_progress", "requires_action"]:
-            time.sleep(0.5)
-            run = projects_client.agents.get_run(thread_id=st.session_state.thread_id, run_id=run.id)
-
-            add_log(f"🔄 Run status: {run.status}", "debug")
+        # Run the agent and handle any function calls as soon as they are requested
+        run = None
+        known_outputs = None
+        if get_config()["RUN_STREAMING"]:
+            handler = MemoryRunEventHandler(projects_client)
+            known_outputs = handler.tool_outputs
+            try:
+                run = run_with_streaming(
+                    projects_client, st.session_state.thread_id, st.session_state.agent_id, handler
+                )
+            except Exception as e:
+                add_log(f"⚠️ Run streaming failed, falling back to polling: {e}", "warning")
+                run = handler.run
 
-            if run.status == "requires_action" and isinstance(run.required_action, SubmitToolOutputsAction):
-                tool_calls = run.required_action.submit_tool_outputs.tool_calls
-                if tool_calls:
-                    process_function_calls(st.session_state.thread_id, run.id, tool_calls)
+        if run is None or run.status in ["queued", "in_progress", "requires_action"]:
+            # Tool calls the stream already answered are resubmitted, not run again
+            run = run_with_polling(
+                projects_client, st.session_state.thread_id, st.session_state.agent_id, run, known_outputs
+            )
 
         if run.status != RunStatus.COMPLETED:
             add_log(f"❌ Run completed with non-success status: {run.status}", "error")
 
         # Get assistant response
-        messages = projects_client.agents.list_messages(thread_id=st.session_state.thread_id)
-        latest = None
-
-        for msg in messages.data:
-            if msg.role == "assistant" and (
-                not latest or msg.created_at > latest.created_at
-            ):
-                latest = msg
+        latest = get_latest_assistant_message(projects_client, st.session_state.thread_id, run.id)
 
         if latest:
             # Extract and display clean text
@@ -783,7 +1916,8 @@ def process_message(user_input):
             st.session_state.messages.append({
                 "role": "assistant", 
                 "content": response_text,
-                "timestamp": current_time
+                "timestamp": current_time,
+                "op_seq": st.session_state.memory_ops.next_seq,
             })
             
             # Show summary of memory usage for this turn
@@ -828,6 +1962,9 @@ def process_message(user_input):
         import traceback
         add_log(traceback.format_exc(), "error")
     
+    # Writes from earlier turns may have failed in the background since
+    report_write_failures()
+
     # Mark that the run is complete
     st.session_state.run_active = False
 
@@ -878,15 +2015,11 @@ def main():
                     # After assistant messages, show memory operations if they exist
                     if message["role"] == "assistant" and i > 0 and st.session_state.inline_ops_toggle:
                         # Get memory operations that occurred between this message and the previous one
-                        if "timestamp" in message:
-                            msg_time = message["timestamp"]
-                            # Filter operations that happened just before this response
-                            relevant_ops = [
-                                op for op in st.session_state.memory_ops 
-                                if "timestamp" in op and op["timestamp"] <= msg_time and 
-                                (i == len(st.session_state.messages)-1 or 
-                                 op["timestamp"] > st.session_state.messages[i-1].get("timestamp", ""))
-                            ]
+                        if "op_seq" in message:
+                            # Slice out the operations logged since the previous message
+                            relevant_ops = st.session_state.memory_ops.between(
+                                st.session_state.messages[i-1].get("op_seq", 0), message["op_seq"]
+                            )
                             
                             if relevant_ops:
                                 # Count operation types
@@ -989,6 +2122,7 @@ def main():
             with col1:
                 if st.button("Show All Facts", use_container_width=True):
                     st.session_state.show_facts = True
+                    st.session_state.fact_page = None
                     st.rerun()
             with col2:
                 if st.button("Show All Retrievals", use_container_width=True):
@@ -997,9 +2131,9 @@ def main():
             
             # Summary of recent memory operations
             st.subheader("Recent Memory Changes")
-            recent_ops = [op for op in st.session_state.memory_ops if "memory_highlight" in op.get("type", "")]
+            recent_ops = st.session_state.memory_ops.recent("memory_highlight", 5)
             if recent_ops:
-                for op in reversed(recent_ops[-5:]):  # Show last 5 memory highlights
+                for op in reversed(recent_ops):  # Show last 5 memory highlights
                     memory_type = ""
                     if "STORED" in op["message"]:
                         memory_type = "stored"
@@ -1014,14 +2148,35 @@ def main():
                         st.info(op["message"])
             else:
                 st.caption("No memory operations yet")
+
+            # Write-behind queue health
+            if get_config()["MEMORY_BACKEND"] != "local":
+                report_write_failures()
+                write_queue = get_memory_write_queue()
+                st.caption(
+                    f"Memory writes: {write_queue.documents_flushed} indexed, "
+                    f"{write_queue.documents_retried} retried, {write_queue.documents_failed} failed "
+                    f"in {write_queue.flushes} batch(es)"
+                )
+                if write_queue.documents_failed:
+                    st.warning(f"Last write error: {write_queue.last_error}")
             
             # Show all facts if requested
             if st.session_state.get("show_facts", False):
                 st.subheader("All Stored Facts")
-                facts = list_all_facts()
+
+                # Only the current page is kept, plus the tokens to fetch earlier pages
+                # again; the first page shows immediately
+                page = st.session_state.fact_page
+                if page is None:
+                    facts, next_token = list_all_facts()
+                    page = {"facts": facts, "token": None, "next_token": next_token, "start": 0}
+                    st.session_state.fact_page = page
+                    st.session_state.fact_page_tokens = []
+                facts = page["facts"]
                 
                 if facts:
-                    for i, fact in enumerate(facts):
+                    for i, fact in enumerate(facts, start=page["start"]):
                         fact_type = fact.get("fact_type", "other")
                         confidence = fact.get("confidence", 1.0)
                         content = fact.get("content", "")
@@ -1030,10 +2185,33 @@ def main():
                         st.markdown(f"**{i+1}. [{fact_type} - {confidence:.2f}]** {content}")
                         with st.expander("Fact Details"):
                             st.code(f"ID: {fact_id}")
+
+                # Fetch another page only when asked for
+                prev_col, next_col = st.columns(2)
+                with prev_col:
+                    if st.session_state.fact_page_tokens and st.button("Previous Facts", use_container_width=True):
+                        token, start = st.session_state.fact_page_tokens.pop()
+                        facts, next_token = list_all_facts(token)
+                        st.session_state.fact_page = {
+                            "facts": facts, "token": token, "next_token": next_token, "start": start
+                        }
+                        st.rerun()
+                with next_col:
+                    if page["next_token"] and st.button("Next Facts", use_container_width=True):
+                        st.session_state.fact_page_tokens.append((page["token"], page["start"]))
+                        facts, next_token = list_all_facts(page["next_token"])
+                        st.session_state.fact_page = {
+                            "facts": facts,
+                            "token": page["next_token"],
+                            "next_token": next_token,
+                            "start": page["start"] + len(page["facts"]),
+                        }
+                        st.rerun()
                             
                 # Button to hide facts
                 if st.button("Hide Facts"):
                     st.session_state.show_facts = False
+                    st.session_state.fact_page = None
                     st.rerun()
                     
             # Show all retrievals if requested
@@ -1041,8 +2219,7 @@ def main():
                 st.subheader("All Memory Retrievals")
                 
                 # Filter for retrieval operations
-                retrieval_ops = [op for op in st.session_state.memory_ops 
-                                if "memory_highlight" in op.get("type", "") and "MEMORIES RETRIEVED" in op.get("message", "")]
+                retrieval_ops = st.session_state.memory_ops.recent("retrieval")
                 
                 if retrieval_ops:
                     for i, op in enumerate(reversed(retrieval_ops)):
@@ -0,0 +1,86 @@
+"""
+Unit tests for how memory_app.MemoryWriteQueue coalesces writes to the same
+memory document. The search index is a fake that records every batch sent.
+
+    python -m unittest discover -s tests
+"""
+
+import os
+import sys
+import unittest
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import memory_app  # noqa: E402
+
+
+class FakeSearchClient:
+    """Accepts every document and keeps the batches it was sent."""
+
+    def __init__(self):
+        self.batches = []
+
+    def index_documents(self, batch):
+        self.batches.append(batch)
+        return [
+            SimpleNamespace(key=action.additional_properties["id"], succeeded=True, status_code=200,
+                            error_message=None)
+            for action in batch.actions
+        ]
+
+
+class MemoryWriteQueueCoalesceTest(unittest.TestCase):
+    def setUp(self):
+        self.search_client = FakeSearchClient()
+        # A long flush interval, so only flush() sends anything
+        self.queue = memory_app.MemoryWriteQueue(self.search_client, flush_seconds=3600)
+        self.addCleanup(self.queue.close)
+
+    def sent(self):
+        self.queue.flush()
+        return [
+            (action.action_type, action.additional_properties)
+            for batch in self.search_client.batches
+            for action in batch.actions
+        ]
+
+    def test_delete_then_merge_keeps_the_delete(self):
+        self.queue.enqueue("delete", {"id": "fact-1"})
+        self.queue.enqueue("merge", {"id": "fact-1", "content": "Now lives in Oslo"})
+
+        self.assertEqual(self.sent(), [("delete", {"id": "fact-1"})])
+
+    def test_delete_then_upload_sends_the_upload(self):
+        doc = {"id": "fact-1", "thread_id": "thread-1", "content": "Lives in Oslo"}
+        self.queue.enqueue("delete", {"id": "fact-1"})
+        self.queue.enqueue("upload", doc)
+
+        self.assertEqual(self.sent(), [("upload", doc)])
+
+    def test_upload_then_merge_sends_one_merged_upload(self):
+        self.queue.enqueue("upload", {"id": "fact-1", "content": "Lives in Lisbon", "confidence": 0.9})
+        self.queue.enqueue("merge", {"id": "fact-1", "content": "Lives in Oslo"})
+
+        self.assertEqual(
+            self.sent(), [("upload", {"id": "fact-1", "content": "Lives in Oslo", "confidence": 0.9})]
+        )
+
+    def test_upload_then_delete_sends_nothing(self):
+        self.queue.enqueue("upload", {"id": "fact-1", "content": "Lives in Oslo"})
+        self.queue.enqueue("delete", {"id": "fact-1"})
+
+        self.assertEqual(self.sent(), [])
+
+    def test_retried_delete_is_not_replaced_by_a_newer_merge(self):
+        self.search_client.index_documents = lambda batch: (_ for _ in ()).throw(ConnectionError("reset"))
+        self.queue.enqueue("delete", {"id": "fact-1"})
+        self.queue.flush()  # fails and queues the delete again
+        self.queue.enqueue("merge", {"id": "fact-1", "content": "Now lives in Oslo"})
+        del self.search_client.index_documents
+
+        self.assertEqual(self.sent(), [("delete", {"id": "fact-1"})])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,19 +1,36 @@
 import os
+import io
+import re
+import csv
 import json
-import pandas as pd
-import pyodbc
+import time
+import sqlite3
+import hashlib
+import atexit
+import contextlib
+import asyncio
+import threading
+import aiohttp
+import numpy as np
 import sqlalchemy
+from collections import OrderedDict
 from azure.ai.projects import AIProjectClient
-from azure.ai.projects.models import BingGroundingTool
+from azure.ai.projects.models import BingGroundingTool, ListSortOrder
 from azure.core.credentials import AzureKeyCredential
+from azure.core.pipeline.transport import AioHttpTransport
 from azure.identity import DefaultAzureCredential
-from azure.search.documents import SearchClient
+from azure.search.documents.aio import SearchClient
 from azure.search.documents.models import VectorizableTextQuery
 from dotenv import load_dotenv
-from openai import AzureOpenAI
+from openai import AsyncAzureOpenAI
 import chainlit as cl
 from chainlit import Step, Starter
 
+try:
+    import tiktoken
+except ImportError:  # optional: token counts fall back to an estimate
+    tiktoken = None
+
 load_dotenv()
 
 # ----------------------------
@@ -27,12 +44,31 @@ AZURE_OPENAI_ENDPOINT = os.getenv(
 AZURE_OPENAI_CHAT_COMPLETION_DEPLOYED_MODEL_NAME = os.getenv(
     "AZURE_OPENAI_CHAT_COMPLETION_DEPLOYED_MODEL_NAME", "gpt-4o"
 )
+# Optional: only needed for near-duplicate matching in the search result cache
+AZURE_OPENAI_EMBEDDING_DEPLOYMENT = os.getenv("AZURE_OPENAI_EMBEDDING_DEPLOYMENT")
 
 AZURE_SEARCH_ENDPOINT = os.getenv(
     "AZURE_SEARCH_SERVICE_ENDPOINT", "https://your-search-service.search.windows.net"
 )
 AZURE_SEARCH_KEY = os.getenv("AZURE_SEARCH_ADMIN_KEY", "your-azure-search-key")
 SEARCH_INDEX_NAME = "acc-guidelines-index"
+# Connection pool size per (endpoint, index) and how often idle clients are re-validated
+AZURE_SEARCH_POOL_MAXSIZE = int(os.getenv("AZURE_SEARCH_POOL_MAXSIZE", "20"))
+AZURE_SEARCH_HEALTH_CHECK_SECONDS = float(
+    os.getenv("AZURE_SEARCH_HEALTH_CHECK_SECONDS", "300")
+)
+# Token budget for the retrieved chunks handed back to the model per search
+SEARCH_CONTEXT_TOKEN_BUDGET = int(os.getenv("SEARCH_CONTEXT_TOKEN_BUDGET", "3000"))
+# Search result cache: size, TTL, optional SQLite file and optional similarity
+# threshold (cosine, e.g. 0.95) for serving near-duplicate questions
+SEARCH_CACHE_MAX_ENTRIES = int(os.getenv("SEARCH_CACHE_MAX_ENTRIES", "256"))
+SEARCH_CACHE_TTL_SECONDS = float(os.getenv("SEARCH_CACHE_TTL_SECONDS", "3600"))
+SEARCH_CACHE_PATH = os.getenv("SEARCH_CACHE_PATH")
+SEARCH_CACHE_SIMILARITY_THRESHOLD = (
+    float(os.environ["SEARCH_CACHE_SIMILARITY_THRESHOLD"])
+    if os.getenv("SEARCH_CACHE_SIMILARITY_THRESHOLD")
+    else None
+)
 
 # Azure AI Project configuration
 AZURE_CONNECTION_STRING = os.getenv(
@@ -40,6 +76,14 @@ AZURE_CONNECTION_STRING = os.getenv(
 )
 BING_CONNECTION_NAME = os.getenv("BING_CONNECTION_NAME", "fsunavalabinggrounding")
 
+# Per-tool time limits (seconds). Tool calls from one model turn run concurrently,
+# so a step takes as long as its slowest tool, capped by these limits.
+TOOL_TIMEOUT_SECONDS = {
+    "lookup_patient_data": float(os.getenv("SQL_TOOL_TIMEOUT_SECONDS", "30")),
+    "search_acc_guidelines": float(os.getenv("SEARCH_TOOL_TIMEOUT_SECONDS", "30")),
+    "search_bing_grounding": float(os.getenv("BING_TOOL_TIMEOUT_SECONDS", "90")),
+}
+
 server = os.getenv("AZURE_SQL_SERVER_NAME")
 database = os.getenv("AZURE_SQL_DATABASE_NAME")
 username = os.getenv("AZURE_SQL_USER_NAME")
@@ -49,32 +93,485 @@ driver = "{ODBC Driver 17 for SQL Server}"
 AZURE_SQL_CONNECTION_STRING = (
     f"DRIVER={driver};SERVER={server};DATABASE={database};UID={username};PWD={password}"
 )
+AZURE_SQL_CONNECTION_URI = (
+    f"mssql+pyodbc://{username}:{password}@{server}/{database}"
+    "?driver=ODBC+Driver+17+for+SQL+Server"
+)
+AZURE_SQL_POOL_SIZE = int(os.getenv("AZURE_SQL_POOL_SIZE", "5"))
+AZURE_SQL_MAX_OVERFLOW = int(os.getenv("AZURE_SQL_MAX_OVERFLOW", "10"))
+AZURE_SQL_POOL_RECYCLE_SECONDS = int(
+    os.getenv("AZURE_SQL_POOL_RECYCLE_SECONDS", "1800")
+)
+# Budget for what the NL2SQL tool hands back to the model
+SQL_MAX_ROWS = int(os.getenv("SQL_MAX_ROWS", "100"))
+SQL_MAX_RESULT_CHARS = int(os.getenv("SQL_MAX_RESULT_CHARS", "20000"))
+SQL_FETCH_BATCH_SIZE = 50
 
 # ----------------------------
 # Initialize Azure OpenAI client
 # ----------------------------
-openai_client = AzureOpenAI(
+# The async client keeps the Chainlit event loop free while waiting on the model,
+# so concurrent chat sessions in one worker do not serialize behind each other.
+openai_client = AsyncAzureOpenAI(
     api_key=AZURE_OPENAI_API_KEY,
     api_version=AZURE_OPENAI_API_VERSION,
     azure_endpoint=AZURE_OPENAI_ENDPOINT,
 )
 
 
+# ----------------------------
+# Shared Azure AI Search clients
+# ----------------------------
+# One pooled, keep-alive SearchClient per (endpoint, index) for the whole process,
+# so tool calls reuse open connections instead of paying a new TLS handshake.
+_search_clients = {}
+_search_clients_lock = asyncio.Lock()
+
+
+def _create_search_client(endpoint: str, index_name: str) -> SearchClient:
+    # Must be called from the running event loop: the aiohttp session binds to it.
+    session = aiohttp.ClientSession(
+        connector=aiohttp.TCPConnector(limit=AZURE_SEARCH_POOL_MAXSIZE)
+    )
+    return SearchClient(
+        endpoint=endpoint,
+        index_name=index_name,
+        credential=AzureKeyCredential(AZURE_SEARCH_KEY),
+        transport=AioHttpTransport(session=session, session_owner=True),
+    )
+
+
+async def get_search_client(
+    endpoint: str = AZURE_SEARCH_ENDPOINT, index_name: str = SEARCH_INDEX_NAME
+) -> SearchClient:
+    """
+    Returns the shared SearchClient for (endpoint, index_name).
+    Clients idle past the health-check interval are probed and rebuilt on failure.
+    """
+    key = (endpoint, index_name)
+    async with _search_clients_lock:
+        entry = _search_clients.get(key)
+        now = time.monotonic()
+        if entry is None:
+            entry = {
+                "client": _create_search_client(endpoint, index_name),
+                "used_at": now,
+            }
+            _search_clients[key] = entry
+            return entry["client"]
+        idle = now - entry["used_at"] > AZURE_SEARCH_HEALTH_CHECK_SECONDS
+        entry["used_at"] = now
+    if not idle:
+        return entry["client"]
+
+    # Probe outside the lock so other sessions are not held up by a slow service
+    try:
+        await entry["client"].get_document_count()
+        return entry["client"]
+    except Exception:
+        pass
+    async with _search_clients_lock:
+        current = _search_clients.get(key)
+        stale = current is entry
+        if stale or current is None:
+            _search_clients[key] = {
+                "client": _create_search_client(endpoint, index_name),
+                "used_at": time.monotonic(),
+            }
+        client = _search_clients[key]["client"]
+    if stale:
+        await entry["client"].close()
+    return client
+
+
+# ----------------------------
+# Search result cache
+# ----------------------------
+class SearchResultCache:
+    """
+    LRU cache of search tool output with a TTL, keyed on the normalized query
+    text plus the search parameters. Entries can also be persisted to a SQLite
+    file, bounded to the same max_entries, and, when embeddings are supplied,
+    looked up by query similarity.
+    """
+
+    def __init__(
+        self, max_entries: int, ttl_seconds: float, path=None, similarity_threshold=None
+    ):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.similarity_threshold = similarity_threshold
+        self.hits = 0
+        self.similar_hits = 0
+        self.misses = 0
+        # key -> (expires_at, params_key, value, embedding)
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._db = None
+        if path:
+            self._db = sqlite3.connect(path, check_same_thread=False)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS search_cache "
+                "(key TEXT PRIMARY KEY, expires_at REAL, value TEXT, used_at REAL DEFAULT 0)"
+            )
+            columns = [row[1] for row in self._db.execute("PRAGMA table_info(search_cache)")]
+            if "used_at" not in columns:  # a file written before the table was size-bounded
+                self._db.execute("ALTER TABLE search_cache ADD COLUMN used_at REAL DEFAULT 0")
+            self._db.commit()
+
+    @staticmethod
+    def _keys(query: str, params: dict):
+        normalized = " ".join(query.lower().split()).rstrip("?.! ")
+        params_key = json.dumps(params, sort_keys=True)
+        key = hashlib.sha256(f"{params_key}\n{normalized}".encode()).hexdigest()
+        return key, params_key
+
+    @staticmethod
+    def _normalize_vector(embedding):
+        vector = np.asarray(embedding, dtype=np.float32)
+        return vector / (np.linalg.norm(vector) or 1.0)
+
+    def get(self, query: str, params: dict):
+        """Returns the cached output for an exact (normalized) match, or None."""
+        key, params_key = self._keys(query, params)
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] > now:
+                self._entries.move_to_end(key)
+                self._touch(key, now)
+                self.hits += 1
+                return entry[2]
+            if entry is not None:
+                del self._entries[key]
+            if self._db is not None:
+                row = self._db.execute(
+                    "SELECT expires_at, value FROM search_cache WHERE key = ?", (key,)
+                ).fetchone()
+                if row is not None and row[0] > now:
+                    self._store(key, row[0], params_key, row[1], None)
+                    self._touch(key, now)
+                    self.hits += 1
+                    return row[1]
+            return None
+
+    def get_similar(self, embedding, params: dict):
+        """
+        Returns the output cached for the most similar earlier query with the same
+        parameters, if its cosine similarity reaches the threshold, or None.
+        This is the last lookup stage after get(), so a None result counts as a miss.
+        """
+        if self.similarity_threshold is None or embedding is None:
+            with self._lock:
+                self.misses += 1
+            return None
+        params_key = json.dumps(params, sort_keys=True)
+        query_vector = self._normalize_vector(embedding)
+        now = time.time()
+        with self._lock:
+            best_key, best_score = None, self.similarity_threshold
+            for key, (expires_at, entry_params, _, vector) in self._entries.items():
+                if vector is None or entry_params != params_key or expires_at <= now:
+                    continue
+                score = float(np.dot(query_vector, vector))
+                if score >= best_score:
+                    best_key, best_score = key, score
+            if best_key is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(best_key)
+            self._touch(best_key, now)
+            self.similar_hits += 1
+            return self._entries[best_key][2]
+
+    def put(self, query: str, params: dict, value: str, embedding=None):
+        """Stores fresh search output."""
+        key, params_key = self._keys(query, params)
+        now = time.time()
+        expires_at = now + self.ttl_seconds
+        vector = None if embedding is None else self._normalize_vector(embedding)
+        with self._lock:
+            self._store(key, expires_at, params_key, value, vector)
+            if self._db is not None:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO search_cache (key, expires_at, value, used_at) "
+                    "VALUES (?, ?, ?, ?)",
+                    (key, expires_at, value, now),
+                )
+                self._db.execute("DELETE FROM search_cache WHERE expires_at <= ?", (now,))
+                # Same LRU bound as in memory: keep the max_entries most recently used
+                self._db.execute(
+                    "DELETE FROM search_cache WHERE key NOT IN "
+                    "(SELECT key FROM search_cache ORDER BY used_at DESC LIMIT ?)",
+                    (self.max_entries,),
+                )
+                self._db.commit()
+
+    def _touch(self, key, now):
+        # Keeps the SQLite copy's LRU order in step with the in-memory one
+        if self._db is not None:
+            self._db.execute("UPDATE search_cache SET used_at = ? WHERE key = ?", (now, key))
+            self._db.commit()
+
+    def _store(self, key, expires_at, params_key, value, vector):
+        self._entries[key] = (expires_at, params_key, value, vector)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "similar_hits": self.similar_hits,
+                "misses": self.misses,
+                "entries": len(self._entries),
+            }
+
+
+search_cache = SearchResultCache(
+    max_entries=SEARCH_CACHE_MAX_ENTRIES,
+    ttl_seconds=SEARCH_CACHE_TTL_SECONDS,
+    path=SEARCH_CACHE_PATH,
+    similarity_threshold=SEARCH_CACHE_SIMILARITY_THRESHOLD,
+)
+
+
+async def embed_query(query: str):
+    """
+    Embeds a query for near-duplicate cache matching. Returns None when
+    similarity matching is not configured.
+    """
+    if not (AZURE_OPENAI_EMBEDDING_DEPLOYMENT and SEARCH_CACHE_SIMILARITY_THRESHOLD):
+        return None
+    try:
+        response = await openai_client.embeddings.create(
+            model=AZURE_OPENAI_EMBEDDING_DEPLOYMENT, input=query
+        )
+    except Exception:
+        return None
+    return response.data[0].embedding
+
+
+# ----------------------------
+# Token-budgeted context assembly
+# ----------------------------
+_token_encoding = None
+
+
+def count_tokens(text: str) -> int:
+    """
+    Counts tokens with tiktoken's o200k_base encoding (GPT-4o) when tiktoken is
+    installed, otherwise estimates ~4 characters per token.
+    """
+    global _token_encoding
+    if tiktoken is None:
+        return (len(text) + 3) // 4
+    if _token_encoding is None:
+        _token_encoding = tiktoken.get_encoding("o200k_base")
+    return len(_token_encoding.encode(text))
+
+
+def _shingles(text: str, size: int = 5) -> set:
+    words = text.lower().split()
+    return {
+        " ".join(words[i : i + size]) for i in range(max(1, len(words) - size + 1))
+    }
+
+
+# Totals across calls; "last_*" describe the most recent call.
+context_metrics = {
+    "calls": 0,
+    "tokens_retrieved": 0,
+    "tokens_used": 0,
+    "tokens_saved": 0,
+    "last_tokens_saved": 0,
+}
+
+
+def build_context(
+    chunks, token_budget: int = SEARCH_CONTEXT_TOKEN_BUDGET, overlap: float = 0.8
+) -> str:
+    """
+    Builds the tool output from (text, score) pairs: highest reranker score first,
+    skipping chunks that mostly repeat text already included, and stopping before
+    the token budget is exceeded.
+    """
+    selected = []
+    seen_shingles = set()
+    tokens_retrieved = 0
+    tokens_used = 0
+    for text, _ in sorted(chunks, key=lambda chunk: chunk[1], reverse=True):
+        if not text:
+            continue
+        tokens = count_tokens(text)
+        tokens_retrieved += tokens
+        shingles = _shingles(text)
+        if len(shingles & seen_shingles) >= overlap * len(shingles):
+            continue
+        if tokens_used + tokens > token_budget:
+            continue
+        selected.append(text)
+        seen_shingles |= shingles
+        tokens_used += tokens
+
+    context_metrics["calls"] += 1
+    context_metrics["tokens_retrieved"] += tokens_retrieved
+    context_metrics["tokens_used"] += tokens_used
+    context_metrics["tokens_saved"] += tokens_retrieved - tokens_used
+    context_metrics["last_tokens_saved"] = tokens_retrieved - tokens_used
+    return "\n".join(selected)
+
+
+# ----------------------------
+# Shared Azure SQL engine
+# ----------------------------
+# One engine (and ODBC connection pool) for the whole process. pool_pre_ping drops
+# connections Azure SQL has closed; pool_recycle retires them before its idle timeout.
+sql_engine = sqlalchemy.create_engine(
+    AZURE_SQL_CONNECTION_URI,
+    pool_size=AZURE_SQL_POOL_SIZE,
+    max_overflow=AZURE_SQL_MAX_OVERFLOW,
+    pool_pre_ping=True,
+    pool_recycle=AZURE_SQL_POOL_RECYCLE_SECONDS,
+)
+
+
+@sqlalchemy.event.listens_for(sql_engine, "connect")
+def set_sql_query_timeout(dbapi_connection, connection_record):
+    """
+    Makes the driver cancel statements that outlive the SQL tool's timeout, so a
+    timed-out lookup does not keep running and holding its pooled connection.
+    """
+    dbapi_connection.timeout = max(1, int(TOOL_TIMEOUT_SECONDS["lookup_patient_data"]))
+
+
+# Time spent waiting for a pooled connection (including the pre-ping), in seconds.
+sql_connection_metrics = {
+    "acquisitions": 0,
+    "total_seconds": 0.0,
+    "max_seconds": 0.0,
+    "last_seconds": 0.0,
+}
+_sql_connection_metrics_lock = threading.Lock()
+
+
+def connect_sql():
+    """
+    Checks a connection out of the shared pool and records how long that took.
+    """
+    start = time.perf_counter()
+    connection = sql_engine.connect()
+    elapsed = time.perf_counter() - start
+    with _sql_connection_metrics_lock:
+        sql_connection_metrics["acquisitions"] += 1
+        sql_connection_metrics["total_seconds"] += elapsed
+        sql_connection_metrics["max_seconds"] = max(
+            sql_connection_metrics["max_seconds"], elapsed
+        )
+        sql_connection_metrics["last_seconds"] = elapsed
+    return connection
+
+
+# ----------------------------
+# Shared Bing Grounding agent
+# ----------------------------
+# The project client, Bing connection and grounding agent are created once, on
+# first use, and reused by every web search; each query only gets its own thread.
+# The Agent Service runs separate threads concurrently against the same agent.
+_project_client = None
+_bing_agent_id = None
+_bing_agent_lock = threading.Lock()
+
+
+def get_bing_agent():
+    """
+    Returns (project_client, agent_id) for the shared Bing grounding agent,
+    creating them on first use.
+    """
+    global _project_client, _bing_agent_id
+    with _bing_agent_lock:
+        if _bing_agent_id is None:
+            if _project_client is None:
+                _project_client = AIProjectClient.from_connection_string(
+                    credential=DefaultAzureCredential(),
+                    conn_str=AZURE_CONNECTION_STRING,
+                )
+
+            # Get the Bing connection and initialize agent bing tool
+            bing_connection = _project_client.connections.get(
+                connection_name=BING_CONNECTION_NAME
+            )
+            bing = BingGroundingTool(connection_id=bing_connection.id)
+
+            # Create agent with the bing tool
+            agent = _project_client.agents.create_agent(
+                model="gpt-4o",  # NOTE, GPT-4o-mini cannot be used with Bing Grounding Tool
+                name="bing-search-agent",
+                instructions="Search the web for information about the user's message. Provide a concise but comprehensive summary.",
+                tools=bing.definitions,
+                headers={"x-ms-enable-preview": "true"},
+            )
+            _bing_agent_id = agent.id
+        return _project_client, _bing_agent_id
+
+
+@atexit.register
+def close_bing_agent():
+    """
+    Deletes the shared Bing grounding agent and closes the project client.
+    Safe to call more than once.
+    """
+    global _project_client, _bing_agent_id
+    with _bing_agent_lock:
+        if _project_client is None:
+            return
+        if _bing_agent_id is not None:
+            try:
+                _project_client.agents.delete_agent(_bing_agent_id)
+            except Exception:
+                pass
+            _bing_agent_id = None
+        _project_client.close()
+        _project_client = None
+
+
+async def close_clients():
+    async with _search_clients_lock:
+        for entry in _search_clients.values():
+            await entry["client"].close()
+        _search_clients.clear()
+    await openai_client.close()
+    await asyncio.to_thread(close_bing_agent)
+    await asyncio.to_thread(sql_engine.dispose)
+
+
 # ----------------------------
 # Define Tool Functions
 # ----------------------------
-def search_acc_guidelines(query: str) -> str:
+async def search_acc_guidelines(query: str) -> str:
     """
     Searches the Azure AI Search index 'acc-guidelines-index'
     for relevant American College of Cardiology (ACC) guidelines.
+    Repeated (or, if configured, near-duplicate) questions are served from search_cache.
     """
-    credential = AzureKeyCredential(AZURE_SEARCH_KEY)
-    client = SearchClient(
-        endpoint=AZURE_SEARCH_ENDPOINT,
-        index_name=SEARCH_INDEX_NAME,
-        credential=credential,
-    )
-    results = client.search(
+    search_params = {
+        "index": SEARCH_INDEX_NAME,
+        "k_nearest_neighbors": 10,
+        "query_type": "semantic",
+        "top": 10,
+        "token_budget": SEARCH_CONTEXT_TOKEN_BUDGET,
+    }
+    cached = search_cache.get(query, search_params)
+    if cached is not None:
+        return cached
+    query_embedding = await embed_query(query)
+    cached = search_cache.get_similar(query_embedding, search_params)
+    if cached is not None:
+        return cached
+
+    client = await get_search_client(AZURE_SEARCH_ENDPOINT, SEARCH_INDEX_NAME)
+    results = await client.search(
         search_text=query,
         vector_queries=[
             VectorizableTextQuery(
@@ -89,12 +586,15 @@ def search_acc_guidelines(query: str) -> str:
         top=10,
         include_total_count=True,
     )
-    retrieved_texts = [result.get("chunk", "") for result in results]
-    context_str = (
-        "\n".join(retrieved_texts)
-        if retrieved_texts
-        else "No relevant guidelines found."
-    )
+    chunks = [
+        (
+            result.get("chunk", ""),
+            result.get("@search.reranker_score") or result.get("@search.score") or 0.0,
+        )
+        async for result in results
+    ]
+    context_str = build_context(chunks) or "No relevant guidelines found."
+    search_cache.put(query, search_params, context_str, query_embedding)
     return context_str
 
 
@@ -103,87 +603,191 @@ def search_bing_grounding(query: str) -> str:
     Searches the public web using the Bing Web Grounding Tool via Azure AI Agent Service.
     Returns information about recent updates from the web.
     """
-    # Create an Azure AI Client
-    project_client = AIProjectClient.from_connection_string(
-        credential=DefaultAzureCredential(),
-        conn_str=AZURE_CONNECTION_STRING,
-    )
-
+    thread = None
     try:
-        with project_client:
-            # Get the Bing connection
-            bing_connection = project_client.connections.get(
-                connection_name=BING_CONNECTION_NAME
-            )
-            conn_id = bing_connection.id
+        project_client, agent_id = get_bing_agent()
 
-            # Initialize agent bing tool
-            bing = BingGroundingTool(connection_id=conn_id)
+        # Create thread for communication; deleted below once the answer is read
+        thread = project_client.agents.create_thread()
 
-            # Create agent with the bing tool
-            agent = project_client.agents.create_agent(
-                model="gpt-4o",  # NOTE, GPT-4o-mini cannot be used with Bing Grounding Tool
-                name="bing-search-agent",
-                instructions=f"Search the web for information about: {query}. Provide a concise but comprehensive summary.",
-                tools=bing.definitions,
-                headers={"x-ms-enable-preview": "true"},
-            )
+        # Create message to thread
+        project_client.agents.create_message(
+            thread_id=thread.id,
+            role="user",
+            content=query,
+        )
 
-            # Create thread for communication
-            thread = project_client.agents.create_thread()
+        # Run the agent, cancelling the run if it outlives the Bing tool's timeout
+        run = project_client.agents.create_run(thread_id=thread.id, agent_id=agent_id)
+        deadline = time.monotonic() + TOOL_TIMEOUT_SECONDS["search_bing_grounding"]
+        while run.status in ("queued", "in_progress", "requires_action"):
+            if time.monotonic() >= deadline:
+                project_client.agents.cancel_run(thread_id=thread.id, run_id=run.id)
+                return "Bing search timed out."
+            time.sleep(1)
+            run = project_client.agents.get_run(thread_id=thread.id, run_id=run.id)
 
-            # Create message to thread
-            project_client.agents.create_message(
-                thread_id=thread.id,
-                role="user",
-                content=query,
+        if run.status == "failed":
+            result_text = f"Bing search failed: {run.last_error}"
+        elif run.status in ("cancelled", "expired"):
+            result_text = f"Bing search did not finish: the run was {run.status}."
+        elif run.status != "completed":
+            result_text = f"Bing search ended with unexpected status '{run.status}'."
+        else:
+            # Fetch only the newest message of this run to get the response
+            messages = project_client.agents.list_messages(
+                thread_id=thread.id, run_id=run.id, order=ListSortOrder.DESCENDING, limit=1
             )
 
-            # Create and process agent run
-            run = project_client.agents.create_and_process_run(
-                thread_id=thread.id, agent_id=agent.id
-            )
+            result_text = "No specific information found."
+            for msg in messages.data:  # Use .data to access the list of messages
+                if msg.role == "assistant" and msg.content:
+                    # Extract the text value from the content
+                    text_items = [
+                        content_item.text.value
+                        for content_item in msg.content
+                        if content_item.type == "text"
+                    ]
+                    if text_items:
+                        result_text = text_items[0]
+                        break
 
-            if run.status == "failed":
-                result_text = f"Bing search failed: {run.last_error}"
-            else:
-                # Fetch messages to get the response
-                messages = project_client.agents.list_messages(thread_id=thread.id)
+    except Exception as e:
+        result_text = f"Bing search failed with error: {str(e)}"
+    finally:
+        if thread is not None:
+            try:
+                project_client.agents.delete_thread(thread.id)
+            except Exception:
+                pass  # best effort; the search result does not depend on it
 
-                # Extract the actual message text - FIXED EXTRACTION LOGIC
-                for msg in messages.data:  # Use .data to access the list of messages
-                    if msg.role == "assistant" and msg.content:
-                        # Extract the text value from the content
-                        for content_item in msg.content:
-                            if content_item.type == "text":
-                                return content_item.text.value  # Return the actual text
+    return result_text
 
-                result_text = "No specific information found."
 
-            # Clean up resources
-            project_client.agents.delete_agent(agent.id)
+# A plain SELECT that does not already limit its rows (TOP) or use DISTINCT/ALL
+# in a way that would make TOP injection ambiguous.
+_UNLIMITED_SELECT = re.compile(
+    r"^\s*SELECT\s+(?:(?:DISTINCT|ALL)\s+)?(?!\s|TOP\b|DISTINCT\b|ALL\b)",
+    re.IGNORECASE,
+)
+_TRAILING_ORDER_BY = re.compile(r"\s+ORDER\s+BY\s+[^()]*$", re.IGNORECASE)
+# TOP cannot be combined with OFFSET ... FETCH paging.
+_PAGED_QUERY = re.compile(
+    r"\bOFFSET\s+\S+\s+ROWS?\b|\bFETCH\s+(?:FIRST|NEXT)\b", re.IGNORECASE
+)
 
-    except Exception as e:
-        result_text = f"Bing search failed with error: {str(e)}"
 
-    return result_text
+def limit_query(query: str, max_rows: int) -> str:
+    """
+    Injects TOP (max_rows) into a plain SELECT so SQL Server stops producing rows
+    early. Any other statement, including one paged with OFFSET ... FETCH, is
+    returned unchanged.
+
+    >>> limit_query("SELECT * FROM PatientMedicalData", 51)
+    'SELECT TOP (51) * FROM PatientMedicalData'
+    >>> limit_query("SELECT DISTINCT Gender FROM PatientMedicalData", 51)
+    'SELECT DISTINCT TOP (51) Gender FROM PatientMedicalData'
+    >>> limit_query("SELECT TOP 5 * FROM PatientMedicalData", 51)
+    'SELECT TOP 5 * FROM PatientMedicalData'
+    >>> limit_query(
+    ...     "SELECT * FROM PatientMedicalData ORDER BY PatientID"
+    ...     " OFFSET 10 ROWS FETCH NEXT 5 ROWS ONLY",
+    ...     51,
+    ... )
+    'SELECT * FROM PatientMedicalData ORDER BY PatientID OFFSET 10 ROWS FETCH NEXT 5 ROWS ONLY'
+    """
+    match = _UNLIMITED_SELECT.match(query)
+    if not match or _PAGED_QUERY.search(query):
+        return query
+    return f"{query[:match.end()]}TOP ({max_rows}) {query[match.end():]}"
+
+
+def count_query_rows(connection, query: str):
+    """
+    Returns the number of rows 'query' would produce, or None if it cannot be counted.
+    """
+    inner = query.strip().rstrip(";")
+    # A paged query needs its ORDER BY; any other trailing one is invalid in a subquery
+    if not _PAGED_QUERY.search(inner):
+        inner = _TRAILING_ORDER_BY.sub("", inner)
+    try:
+        return connection.exec_driver_sql(
+            f"SELECT COUNT_BIG(*) FROM ({inner}) AS counted_rows"
+        ).scalar()
+    except Exception:
+        return None
 
 
 def lookup_patient_data(query: str) -> str:
     """
-    Queries the 'PatientMedicalData' table in Azure SQL and returns the results as a string.
+    Queries the 'PatientMedicalData' table in Azure SQL and returns the results as CSV.
     'query' should be a valid SQL statement.
+    Rows are fetched in batches and rendering stops at SQL_MAX_ROWS rows or
+    SQL_MAX_RESULT_CHARS characters (the row that crosses the character budget
+    is cut at it), so memory stays flat for any table size.
     """
     try:
-        connection_uri = (
-            f"mssql+pyodbc://{username}:{password}@{server}/{database}"
-            "?driver=ODBC+Driver+17+for+SQL+Server"
-        )
-        engine = sqlalchemy.create_engine(connection_uri)
-        df = pd.read_sql(query, engine)
-        if df.empty:
-            return "No rows found."
-        return df.to_string(index=False)
+        # Ask for one extra row so we can tell whether the result was cut off.
+        limited_query = limit_query(query, SQL_MAX_ROWS + 1)
+        buffer = io.StringIO()
+        writer = csv.writer(buffer, lineterminator="\n")
+        row_count = 0
+        truncated = False
+        cut_row = False
+
+        with connect_sql() as connection:
+            result = connection.exec_driver_sql(limited_query)
+            if not result.returns_rows:
+                return "No rows found."
+
+            writer.writerow(result.keys())
+            while not truncated:
+                rows = result.fetchmany(SQL_FETCH_BATCH_SIZE)
+                if not rows:
+                    break
+                for row in rows:
+                    if row_count >= SQL_MAX_ROWS:
+                        truncated = True
+                        break
+                    row_start = buffer.tell()
+                    writer.writerow(row)
+                    if buffer.tell() > SQL_MAX_RESULT_CHARS:
+                        # Keep the text up to the budget; this row does not fit whole
+                        buffer.seek(SQL_MAX_RESULT_CHARS)
+                        buffer.truncate()
+                        cut_row = SQL_MAX_RESULT_CHARS > row_start
+                        truncated = True
+                        break
+                    row_count += 1
+            result.close()
+
+            if row_count == 0 and not truncated:
+                return "No rows found."
+
+            if truncated:
+                total = (
+                    count_query_rows(connection, query)
+                    if limited_query != query
+                    else None
+                )
+                shown = (
+                    f"{row_count} of {total} rows"
+                    if total is not None
+                    else f"the first {row_count} rows"
+                )
+                if cut_row:
+                    buffer.write(
+                        f"...\n[Truncated at {SQL_MAX_RESULT_CHARS} characters: "
+                        f"showing {shown} in full, the next one cut off]\n"
+                    )
+                elif buffer.tell() >= SQL_MAX_RESULT_CHARS:
+                    buffer.write(
+                        f"[Truncated at {SQL_MAX_RESULT_CHARS} characters: showing {shown}]\n"
+                    )
+                else:
+                    buffer.write(f"[Truncated: showing {shown}]\n")
+
+        return buffer.getvalue()
     except Exception as e:
         return f"Database error: {str(e)}"
 
@@ -225,7 +829,9 @@ tools = [
                 "HeartRate_bpm: INT,\n"
                 "Temperature_C: DECIMAL(3,1),\n"
                 "Notes: VARCHAR(MAX)\n\n"
-                "Generate and execute a safe SQL query based on the user's natural language request."
+                "Generate and execute a safe SQL query based on the user's natural language request.\n"
+                f"At most {SQL_MAX_ROWS} rows are returned, as CSV; use COUNT, GROUP BY "
+                "or other aggregates when the user needs totals over many rows."
             ),
             "parameters": {
                 "type": "object",
@@ -289,8 +895,9 @@ tool_implementations = {
 async def lookup_patient_data_step(function_args: dict):
     """
     Execute the lookup_patient_data tool as a Chainlit step.
+    pyodbc is blocking, so the query runs on a worker thread.
     """
-    return lookup_patient_data(**function_args)
+    return await asyncio.to_thread(lookup_patient_data, **function_args)
 
 
 @cl.step(name="Azure AI Search Knowledge Retrieval Tool", type="tool")
@@ -298,15 +905,205 @@ async def search_acc_guidelines_step(function_args: dict):
     """
     Execute the search_acc_guidelines tool as a Chainlit step.
     """
-    return search_acc_guidelines(**function_args)
+    return await search_acc_guidelines(**function_args)
 
 
 @cl.step(name="Bing Web Grounding Tool", type="tool")
 async def search_bing_grounding_step(function_args: dict):
     """
     Execute the search_bing_grounding tool as a Chainlit step.
+    The Agent Service SDK calls are blocking, so they run on a worker thread.
     """
-    return search_bing_grounding(**function_args)
+    return await asyncio.to_thread(search_bing_grounding, **function_args)
+
+
+tool_steps = {
+    "lookup_patient_data": lookup_patient_data_step,
+    "search_acc_guidelines": search_acc_guidelines_step,
+    "search_bing_grounding": search_bing_grounding_step,
+}
+
+
+async def run_tool_call(tool_call: dict, user_query: str) -> str:
+    """
+    Run one tool call through its Chainlit step, bounded by the tool's timeout.
+    Errors and timeouts are returned as text so the model can react to them.
+    The SQL and Bing tools run in worker threads that a timeout cannot stop; the
+    abandoned work is ended on the server instead (the SQL query timeout and the
+    Bing run deadline use the same limits).
+    """
+    function_name = tool_call["function"]["name"]
+    try:
+        function_args = json.loads(tool_call["function"]["arguments"])
+    except json.JSONDecodeError:
+        function_args = {"query": user_query}
+
+    step = tool_steps.get(function_name)
+    if step is None:
+        return f"[Error] No implementation for function '{function_name}'."
+
+    timeout = TOOL_TIMEOUT_SECONDS.get(function_name)
+    try:
+        return str(await asyncio.wait_for(step(function_args=function_args), timeout))
+    except asyncio.TimeoutError:
+        return f"[Error] '{function_name}' timed out after {timeout:.0f} seconds."
+    except Exception as e:
+        return f"[Error] '{function_name}' failed: {str(e)}"
+
+
+# ----------------------------
+# Streaming and time-to-first-token metrics
+# ----------------------------
+# Totals across answers; "last_seconds" describes the most recent answer.
+ttft_metrics = {
+    "answers": 0,
+    "total_seconds": 0.0,
+    "max_seconds": 0.0,
+    "last_seconds": None,
+}
+
+
+def record_first_token(timing: dict, at: float = None):
+    timing["first_token_at"] = time.perf_counter() if at is None else at
+    elapsed = timing["first_token_at"] - timing["started_at"]
+    ttft_metrics["answers"] += 1
+    ttft_metrics["total_seconds"] += elapsed
+    ttft_metrics["max_seconds"] = max(ttft_metrics["max_seconds"], elapsed)
+    ttft_metrics["last_seconds"] = elapsed
+
+
+async def stream_completion(answer_msg: cl.Message, timing: dict, **kwargs):
+    """
+    Streams one chat completion. Content tokens are piped into answer_msg as they
+    arrive; tool-call deltas are assembled by index into complete tool calls.
+    Once the model starts calling tools its text is not the answer, so it is moved
+    into (and further tokens go to) a "Thinking" step instead, and only a
+    completion that ends without tool calls counts towards time to first token.
+    Returns (content, tool_calls), with tool_calls in the chat message format.
+    """
+    stream = await openai_client.chat.completions.create(
+        model=AZURE_OPENAI_CHAT_COMPLETION_DEPLOYED_MODEL_NAME, stream=True, **kwargs
+    )
+    content = ""
+    tool_calls = {}
+    thinking_step = None
+    first_content_at = None
+    async for chunk in stream:
+        if not chunk.choices:  # e.g. Azure content filter results
+            continue
+        delta = chunk.choices[0].delta
+        if delta.tool_calls and thinking_step is None:
+            thinking_step = cl.Step(name="Thinking", type="llm")
+            if content:
+                await thinking_step.stream_token(content)
+                answer_msg.content = ""
+                await answer_msg.update()
+        for tool_call_delta in delta.tool_calls or []:
+            tool_call = tool_calls.setdefault(
+                tool_call_delta.index,
+                {"id": "", "type": "function", "function": {"name": "", "arguments": ""}},
+            )
+            if tool_call_delta.id:
+                tool_call["id"] = tool_call_delta.id
+            if tool_call_delta.function:
+                tool_call["function"]["name"] += tool_call_delta.function.name or ""
+                tool_call["function"]["arguments"] += (
+                    tool_call_delta.function.arguments or ""
+                )
+        if delta.content:
+            if first_content_at is None:
+                first_content_at = time.perf_counter()
+            content += delta.content
+            await (thinking_step or answer_msg).stream_token(delta.content)
+    if thinking_step is not None and content:
+        await thinking_step.send()
+    elif first_content_at is not None and timing["first_token_at"] is None:
+        # No tool calls: the streamed text was the final answer
+        record_first_token(timing, at=first_content_at)
+    return content, [tool_calls[index] for index in sorted(tool_calls)]
+
+
+# ----------------------------
+# Conversation history compaction
+# ----------------------------
+# Tool outputs the model has already read are replaced by a short excerpt once the
+# prompt would exceed the budget, so later steps don't resend whole SQL tables or
+# search chunks. "last_step_tokens" lists the prompt tokens sent at each step of
+# the most recent answer.
+AGENT_PROMPT_TOKEN_BUDGET = int(os.getenv("AGENT_PROMPT_TOKEN_BUDGET", "12000"))
+COMPACTED_TOOL_OUTPUT_TOKENS = int(os.getenv("COMPACTED_TOOL_OUTPUT_TOKENS", "200"))
+
+prompt_token_metrics = {
+    "steps": 0,
+    "prompt_tokens": 0,
+    "compacted_outputs": 0,
+    "tokens_saved": 0,
+    "last_step_tokens": [],
+}
+
+
+def message_tokens(message: dict) -> int:
+    tokens = 4  # role and message framing
+    tokens += count_tokens(message.get("content") or "")
+    for tool_call in message.get("tool_calls") or []:
+        tokens += count_tokens(tool_call["function"]["name"])
+        tokens += count_tokens(tool_call["function"]["arguments"])
+    return tokens
+
+
+def summarize_tool_output(message: dict, max_tokens: int) -> str:
+    """
+    Keeps the leading lines of a consumed tool output (SQL headers and first rows,
+    top-ranked chunks) up to max_tokens and replaces the rest with a reference.
+    """
+    lines = []
+    tokens = 0
+    for line in message["content"].splitlines():
+        line_tokens = count_tokens(line) + 1
+        if tokens + line_tokens > max_tokens:
+            break
+        lines.append(line)
+        tokens += line_tokens
+    lines.append(
+        f"[Earlier {message.get('name', 'tool')} output (call {message['tool_call_id']}) "
+        f"truncated; it was already used in a previous step.]"
+    )
+    return "\n".join(lines)
+
+
+def compact_history(
+    messages: list,
+    consumed_ids: set,
+    summaries: dict,
+    token_budget: int = AGENT_PROMPT_TOKEN_BUDGET,
+):
+    """
+    Returns (prompt_messages, prompt_tokens). While the prompt is over token_budget,
+    consumed tool outputs are swapped, oldest first, for their summaries. Summaries
+    are cached by tool_call_id so a compacted output reads the same on every step.
+    """
+    prompt = [dict(message) for message in messages]
+    sizes = [message_tokens(message) for message in prompt]
+    total = sum(sizes)
+    for i, message in enumerate(prompt):
+        if total <= token_budget:
+            break
+        if message["role"] != "tool" or message["tool_call_id"] not in consumed_ids:
+            continue
+        if message["tool_call_id"] not in summaries:
+            summaries[message["tool_call_id"]] = summarize_tool_output(
+                message, COMPACTED_TOOL_OUTPUT_TOKENS
+            )
+        message["content"] = summaries[message["tool_call_id"]]
+        compacted_size = message_tokens(message)
+        if compacted_size < sizes[i]:
+            prompt_token_metrics["compacted_outputs"] += 1
+            prompt_token_metrics["tokens_saved"] += sizes[i] - compacted_size
+            total -= sizes[i] - compacted_size
+            sizes[i] = compacted_size
+        else:
+            message["content"] = messages[i]["content"]
+    return prompt, total
 
 
 # ----------------------------
@@ -327,92 +1124,238 @@ SYSTEM_PROMPT = (
 # The Multi-Step Agent using Steps
 # ----------------------------
 async def run_multi_step_agent(user_query: str, max_steps: int = 5):
+    timing = {"started_at": time.perf_counter(), "first_token_at": None}
+    answer_msg = cl.Message(content="", author="Agent")
     messages = [
         {"role": "system", "content": SYSTEM_PROMPT},
         {"role": "user", "content": user_query},
     ]
+    consumed_ids = set()
+    summaries = {}
+    prompt_token_metrics["last_step_tokens"] = []
 
-    for step_num in range(max_steps):
-        response = openai_client.chat.completions.create(
-            model=AZURE_OPENAI_CHAT_COMPLETION_DEPLOYED_MODEL_NAME,
-            messages=messages,
-            tools=tools,
-            tool_choice="auto",
-        )
-        response_message = response.choices[0].message
-
-        # FIXED: Properly format the assistant message with tool calls
-        if response_message.tool_calls:
-            # Add the assistant message with proper structure for tool calls
-            messages.append(
-                {
-                    "role": "assistant",
-                    "content": response_message.content,  # This might be None when tool_calls are present
-                    "tool_calls": [
-                        {
-                            "id": tool_call.id,
-                            "type": "function",
-                            "function": {
-                                "name": tool_call.function.name,
-                                "arguments": tool_call.function.arguments,
-                            },
-                        }
-                        for tool_call in response_message.tool_calls
-                    ],
-                }
-            )
+    try:
+        for step_num in range(max_steps):
+            prompt_messages, prompt_tokens = compact_history(messages, consumed_ids, summaries)
+            prompt_token_metrics["steps"] += 1
+            prompt_token_metrics["prompt_tokens"] += prompt_tokens
+            prompt_token_metrics["last_step_tokens"].append(prompt_tokens)
 
-            # We might have multiple tool calls in one message
-            for tool_call in response_message.tool_calls:
-                function_name = tool_call.function.name
-                tool_call_id = tool_call.id  # Extract the exact tool_call_id
-                raw_args = tool_call.function.arguments
-
-                try:
-                    function_args = json.loads(raw_args)
-                except json.JSONDecodeError:
-                    function_args = {"query": user_query}
-
-                # Call the appropriate Chainlit step depending on the tool function name.
-                if function_name == "lookup_patient_data":
-                    tool_output = await lookup_patient_data_step(
-                        function_args=function_args
-                    )
-                elif function_name == "search_acc_guidelines":
-                    tool_output = await search_acc_guidelines_step(
-                        function_args=function_args
-                    )
-                elif function_name == "search_bing_grounding":
-                    tool_output = await search_bing_grounding_step(
-                        function_args=function_args
-                    )
-                else:
-                    tool_output = (
-                        f"[Error] No implementation for function '{function_name}'."
-                    )
+            content, tool_calls = await stream_completion(
+                answer_msg,
+                timing,
+                messages=prompt_messages,
+                tools=tools,
+                tool_choice="auto",
+            )
+            # Every tool output in this prompt has now been read by the model
+            consumed_ids.update(m["tool_call_id"] for m in messages if m["role"] == "tool")
 
-                # Now add the tool's response to the conversation as a string
-                # FIXED: Use the exact tool_call_id
+            # FIXED: Properly format the assistant message with tool calls
+            if tool_calls:
+                # Add the assistant message with proper structure for tool calls
                 messages.append(
                     {
-                        "tool_call_id": tool_call_id,
-                        "role": "tool",
-                        "name": function_name,
-                        "content": str(tool_output),
+                        "role": "assistant",
+                        "content": content or None,  # Usually empty when tool_calls are present
+                        "tool_calls": tool_calls,
                     }
                 )
-        else:
-            # The model returned a final answer - no tool calls
-            messages.append({"role": "assistant", "content": response_message.content})
 
-            final_answer = response_message.content
-            await cl.Message(content=final_answer, author="Agent").send()
-            return
+                # We might have multiple tool calls in one message; they are independent,
+                # so run them concurrently. gather() preserves the order of tool_calls,
+                # and cancelling this handler cancels any calls still in flight.
+                tool_outputs = await asyncio.gather(
+                    *(run_tool_call(tool_call, user_query) for tool_call in tool_calls)
+                )
+
+                for tool_call, tool_output in zip(tool_calls, tool_outputs):
+                    # FIXED: Use the exact tool_call_id
+                    messages.append(
+                        {
+                            "tool_call_id": tool_call["id"],
+                            "role": "tool",
+                            "name": tool_call["function"]["name"],
+                            "content": tool_output,
+                        }
+                    )
+            else:
+                # The model returned a final answer - no tool calls. It has already
+                # been streamed into answer_msg; send() below finalizes the message.
+                messages.append({"role": "assistant", "content": content})
+                return
+
+        # If we reach here, we never got a final answer
+        answer_msg.content = "Max steps reached without a final answer. Stopping."
+    finally:
+        # Finalize answer_msg on every exit, including errors and a stopped task,
+        # so a partly streamed answer is not left open
+        if answer_msg.content:
+            await answer_msg.send()
+
+
+# ----------------------------
+# Plan-then-Execute Agent
+# ----------------------------
+# AGENT_MODE=plan answers with one planning call, a local executor that runs the
+# planned tool calls (independent ones concurrently) and one synthesis call, instead
+# of one model round trip per step of the reactive loop above.
+AGENT_MODE = os.getenv("AGENT_MODE", "reactive").lower()
+PLAN_MAX_STEPS = int(os.getenv("PLAN_MAX_STEPS", "8"))
+
+PLANNER_PROMPT = (
+    "You plan tool calls for a cardiology-focused AI assistant. Available tools:\n"
+    "{tool_list}\n\n"
+    'Return a JSON object {{"steps": [...]}} where each step is '
+    '{{"id": "s1", "tool": <tool name>, "arguments": {{...}}, "depends_on": [<step ids>]}}.\n'
+    "Plan every call needed to answer the question up front. Steps that don't need "
+    "another step's output must have an empty depends_on so they run in parallel. "
+    'A string argument may contain "{{s1}}" to insert the output of step s1.\n'
+    'Return {{"steps": []}} if no tool is needed.'
+)
+
+SYNTHESIS_PROMPT = (
+    "You are a cardiology-focused AI assistant. Answer the user's question using the "
+    "tool results provided. If a result is an error, say what could not be verified."
+)
+
+# Totals across answers in plan mode
+plan_metrics = {
+    "answers": 0,
+    "llm_calls": 0,
+    "tool_calls": 0,
+    "fallbacks": 0,
+}
+
+
+def describe_tools() -> str:
+    lines = []
+    for tool in tools:
+        function = tool["function"]
+        params = ", ".join(function.get("parameters", {}).get("properties", {}))
+        lines.append(f"- {function['name']}({params}): {function['description']}")
+    return "\n".join(lines)
+
+
+async def plan_tool_calls(user_query: str) -> list:
+    """
+    Asks the model for the whole tool plan in one call. Returns a list of steps
+    ({"id", "tool", "arguments", "depends_on"}); unknown dependencies are dropped.
+    """
+    response = await openai_client.chat.completions.create(
+        model=AZURE_OPENAI_CHAT_COMPLETION_DEPLOYED_MODEL_NAME,
+        response_format={"type": "json_object"},
+        messages=[
+            {"role": "system", "content": PLANNER_PROMPT.format(tool_list=describe_tools())},
+            {"role": "user", "content": user_query},
+        ],
+    )
+    plan_metrics["llm_calls"] += 1
+    plan = json.loads(response.choices[0].message.content or "{}")
+
+    steps = []
+    for i, step in enumerate(plan.get("steps", [])[:PLAN_MAX_STEPS]):
+        steps.append(
+            {
+                "id": str(step.get("id") or f"s{i + 1}"),
+                "tool": step.get("tool", ""),
+                "arguments": step.get("arguments") or {},
+                "depends_on": [str(d) for d in step.get("depends_on") or []],
+            }
+        )
+    step_ids = {step["id"] for step in steps}
+    for step in steps:
+        step["depends_on"] = [d for d in step["depends_on"] if d in step_ids]
+    return steps
+
+
+def fill_placeholders(value, outputs: dict):
+    """Replaces {step_id} in string arguments with that step's output."""
+    if isinstance(value, str):
+        return re.sub(
+            r"\{([\w-]+)\}", lambda m: outputs.get(m.group(1), m.group(0)), value
+        )
+    if isinstance(value, dict):
+        return {k: fill_placeholders(v, outputs) for k, v in value.items()}
+    if isinstance(value, list):
+        return [fill_placeholders(v, outputs) for v in value]
+    return value
 
-    # If we reach here, we never got a final answer
-    await cl.Message(
-        content="Max steps reached without a final answer. Stopping.", author="Agent"
-    ).send()
+
+async def execute_plan(steps: list, user_query: str) -> dict:
+    """
+    Runs the plan in waves: every step whose dependencies have finished runs
+    concurrently with the others in its wave. Returns {step_id: output}.
+    """
+    outputs = {}
+    pending = list(steps)
+    while pending:
+        ready = [s for s in pending if all(d in outputs for d in s["depends_on"])]
+        if not ready:
+            for step in pending:
+                outputs[step["id"]] = "[Error] Step skipped: its dependencies form a cycle."
+            break
+
+        results = await asyncio.gather(
+            *(
+                run_tool_call(
+                    {
+                        "id": step["id"],
+                        "function": {
+                            "name": step["tool"],
+                            "arguments": json.dumps(
+                                fill_placeholders(step["arguments"], outputs)
+                            ),
+                        },
+                    },
+                    user_query,
+                )
+                for step in ready
+            )
+        )
+        plan_metrics["tool_calls"] += len(ready)
+        for step, result in zip(ready, results):
+            outputs[step["id"]] = result
+        pending = [s for s in pending if s["id"] not in outputs]
+    return outputs
+
+
+async def run_plan_and_execute_agent(user_query: str):
+    timing = {"started_at": time.perf_counter(), "first_token_at": None}
+    try:
+        steps = await plan_tool_calls(user_query)
+    except Exception:
+        # No usable plan (API error or malformed JSON): answer reactively instead
+        plan_metrics["fallbacks"] += 1
+        await run_multi_step_agent(user_query)
+        return
+
+    answer_msg = cl.Message(content="", author="Agent")
+    try:
+        outputs = await execute_plan(steps, user_query)
+        tool_results = "\n\n".join(
+            f"### {step['id']}: {step['tool']}({json.dumps(step['arguments'])})\n{outputs[step['id']]}"
+            for step in steps
+        )
+
+        await stream_completion(
+            answer_msg,
+            timing,
+            messages=[
+                {"role": "system", "content": SYNTHESIS_PROMPT},
+                {"role": "user", "content": user_query},
+                {"role": "system", "content": f"Tool results:\n\n{tool_results or 'No tools were needed.'}"},
+            ],
+        )
+        plan_metrics["llm_calls"] += 1
+        plan_metrics["answers"] += 1
+    except Exception as e:
+        # Keep whatever was streamed and say why the answer stops there
+        answer_msg.content += f"\n\n[Error] Could not finish the answer: {str(e)}"
+    finally:
+        # As in run_multi_step_agent, finalize answer_msg on every exit
+        if answer_msg.content:
+            await answer_msg.send()
 
 
 # ----------------------------
@@ -454,4 +1397,34 @@ async def set_starters():
 
 @cl.on_message
 async def main(message: cl.Message):
-    await run_multi_step_agent(message.content)
+    if AGENT_MODE == "plan":
+        await run_plan_and_execute_agent(message.content)
+    else:
+        await run_multi_step_agent(message.content)
+
+
+# on_app_shutdown exists from chainlit 2.6; hasattr() cannot test for it, since
+# older versions raise KeyError for unknown names. Those versions (such as the
+# pinned 2.2.1) have no shutdown hook, so the server's lifespan is wrapped instead
+# and the clients are closed on its event loop once the server stops.
+if "on_app_shutdown" in vars(cl):
+
+    @cl.on_app_shutdown
+    async def shutdown():
+        await close_clients()
+
+else:
+    from chainlit.server import app as chainlit_app
+
+    _chainlit_lifespan = chainlit_app.router.lifespan_context
+
+    @contextlib.asynccontextmanager
+    async def lifespan_closing_clients(app):
+        async with _chainlit_lifespan(app):
+            try:
+                yield
+            finally:
+                # Inside chainlit's lifespan: it ends the process with os._exit()
+                await close_clients()
+
+    chainlit_app.router.lifespan_context = lifespan_closing_clients